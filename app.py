@@ -2,18 +2,41 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import os
 import json
+import base64
+import hashlib
+import hmac
+import codecs
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import babel.dates
+import calendar
+import functools
+import itertools
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify, g, session, stream_with_context
+from flask.json import JSONEncoder
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 import logging
+import click
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from flask_migrate import Migrate
-from datetime import datetime # Added this to calculate the current time
+from datetime import date, datetime, timedelta, timezone # Added this to calculate the current time
 from forms import *
+from cache import create_cache
+from instrumentation import queries
+from pool import engine_options, pool_stats
+import routing
+from routing import RoutingSQLAlchemy, RoutingSession, using_replica
+from schedule import ScheduleIndex
+from concurrency import Batch
+from bulk import FORMATS, EXPORT_FORMATS, read_rows, format_from_name, batches, copy_text, \
+  write_csv, write_ndjson, write_parquet, parquet_type, gzip_parts
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from werkzeug.datastructures import MultiDict
 from wtforms import Form, validators
 
 #----------------------------------------------------------------------------#
@@ -23,11 +46,25 @@ from wtforms import Form, validators
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
+# The options of the connection pool (see pool.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
 # Added this because of the error: 'The CSRF token is missing.' (Reference: https://flask-wtf.readthedocs.io/en/v0.12/csrf.html)
 csrf.init_app(app)
-db = SQLAlchemy(app)
+# Route the read-only views to the read replicas, if there are any (see routing.py)
+routing.init_app(app)
+db = RoutingSQLAlchemy(app)
 
 migrate = Migrate(app, db)
+# The cache of the venue and artist detail pages (see 'Detail cache')
+detail_cache = create_cache(app.config)
+# Count and time the SQL statements of every request (see instrumentation.py)
+queries.init_app(app)
+
+# This function returns the loading strategy of a relationship (e.g. 'Venue.shows') from 'RELATIONSHIP_LOADING' in config.py
+# (Reference: https://docs.sqlalchemy.org/en/13/orm/loading_relationships.html)
+def relationship_loading(name):
+  return app.config.get('RELATIONSHIP_LOADING', {}).get(name, 'select')
+
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
@@ -42,6 +79,17 @@ migrate = Migrate(app, db)
 """
 class Venue(db.Model):
     __tablename__ = 'venues'
+    # The trigram indexes used by the search on PostgreSQL (see the migrations 'b1d4f2a7c903' and '5e1c7a9d3b24')
+    __table_args__ = (
+        db.Index('ix_venues_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_venues_city_trgm', 'city', postgresql_using='gin',
+                 postgresql_ops={'city': 'gin_trgm_ops'}),
+        db.Index('ix_venues_state_trgm', 'state', postgresql_using='gin',
+                 postgresql_ops={'state': 'gin_trgm_ops'}),
+        # The index of the venues by location used by the availability (see the migration '9b3e5d7c1f62')
+        db.Index('ix_venues_state_city', 'state', 'city'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(), nullable=False)
@@ -54,77 +102,43 @@ class Venue(db.Model):
     website = db.Column(db.String(500))
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String())
+    # The maintained numbers of the venue's upcoming and past shows (see 'Shows counters')
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # The time (UTC) of the last change, used by the conditional requests (see 'Conditional requests')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, server_default=db.func.now())
     # This is to define the 'Venue' and 'Genre' relationship
-    genres = db.relationship('Venues_Genres', backref='venue', lazy=True)
+    genres = db.relationship('Venues_Genres', backref='venue',
+                             lazy=relationship_loading('Venue.genres'))
     # This is to define the 'Venue' and 'Show' relationship
-    shows = db.relationship('Show', backref='venue', lazy=True)
+    shows = db.relationship('Show', backref=db.backref('venue', lazy=relationship_loading('Show.venue')),
+                            lazy=relationship_loading('Venue.shows'))
 
     def __repr__(self):
       return f'<Venue ID: {self.id}, name: {self.name}, city: {self.city}, state: {self.state}>'
 
     # This function finds the number of the upcoming shows for a venue
     def upcoming_shows_number(self):
-      # Get all the shows for the venue by its ID
-      shows = Show.query.filter_by(venue_id=self.id).all()
-      # Get the current time
-      today = datetime.now()
-      # Initialize the number of shows to zero for each venue
-      num_shows = 0
-      # Loop all the venue's shows
-      for s in shows:
-        # Check if the show is upcoming
-        if s.start_time >= today:
-          # Increase the number of shows
-          num_shows = num_shows + 1
-      return num_shows
+      # Read the maintained counter instead of counting the shows
+      return self.upcoming_shows_count
 
     # This function finds the number of the past shows for a venue
     def past_shows_number(self):
-      # Get all the shows for the venue by its ID
-      shows = Show.query.filter_by(venue_id=self.id).all()
-      # Get the current time
-      today = datetime.now()
-      # Initialize the number of shows to zero for each venue
-      num_shows = 0
-      # Loop all the venue's shows
-      for s in shows:
-        # Check if the show is upcoming
-        if s.start_time < today:
-          # Increase the number of shows
-          num_shows = num_shows + 1
-      return num_shows
+      # Read the maintained counter instead of counting the shows
+      return self.past_shows_count
       
     # This function finds all the upcoming shows for a venue
     def upcoming_shows(self):
-      # Get all the shows for the venue by its ID
-      shows = Show.query.filter_by(venue_id=self.id).all()
-      # Get the current time
-      today = datetime.now()
-      # Initialize the shows list
-      shows_list = []
-      # Loop all the venue's shows
-      for s in shows:
-        # Check if the show is upcoming
-        if s.start_time >= today:
-          # Add the show in the shows list
-          shows_list.append(s)
-      return shows_list
+      # Let the database filter the venue's shows by the current time
+      return Show.query.filter(Show.venue_id == self.id,
+                               Show.start_time >= datetime.now()).all()
 
     # This function finds all the past shows for a venue
     def past_shows(self):
-      # Get all the shows for the venue by its ID
-      shows = Show.query.filter_by(venue_id=self.id).all()
-      # Get the current time
-      today = datetime.now()
-      # Initialize the shows list
-      shows_list = []
-      # Loop all the venue's shows
-      for s in shows:
-        # Check if the show is upcoming
-        if s.start_time < today:
-          # Add the show in the shows list
-          shows_list.append(s)
-      return shows_list
+      # Let the database filter the venue's shows by the current time
+      return Show.query.filter(Show.venue_id == self.id,
+                               Show.start_time < datetime.now()).all()
 
     # This function gets all the genres of the venue
     def genres_types(self):
@@ -151,6 +165,11 @@ class Venue(db.Model):
 """
 class Venues_Genres(db.Model):
     __tablename__ = 'venues_genres'
+    # The trigram index used by the search on PostgreSQL (see the migration 'b1d4f2a7c903')
+    __table_args__ = (
+        db.Index('ix_venues_genres_genre_trgm', 'genre', postgresql_using='gin',
+                 postgresql_ops={'genre': 'gin_trgm_ops'}),
+    )
 
     # This is to define the foreign key of the 'Venue' model
     venue_id = db.Column(db.Integer, db.ForeignKey(
@@ -169,6 +188,15 @@ class Venues_Genres(db.Model):
 """
 class Artist(db.Model):
     __tablename__ = 'artists'
+    # The trigram indexes used by the search on PostgreSQL (see the migrations 'b1d4f2a7c903' and '5e1c7a9d3b24')
+    __table_args__ = (
+        db.Index('ix_artists_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_artists_city_trgm', 'city', postgresql_using='gin',
+                 postgresql_ops={'city': 'gin_trgm_ops'}),
+        db.Index('ix_artists_state_trgm', 'state', postgresql_using='gin',
+                 postgresql_ops={'state': 'gin_trgm_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(), nullable=False)
@@ -180,77 +208,43 @@ class Artist(db.Model):
     website = db.Column(db.String(500))
     seeking_venue = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String())
+    # The maintained numbers of the artist's upcoming and past shows (see 'Shows counters')
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # The time (UTC) of the last change, used by the conditional requests (see 'Conditional requests')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, server_default=db.func.now())
     # This is to define the 'Artist' and 'Genre' relationship
-    genres = db.relationship('Artists_Genres', backref='artist', lazy=True)
+    genres = db.relationship('Artists_Genres', backref='artist',
+                             lazy=relationship_loading('Artist.genres'))
     # This is to define the 'Artist' and 'Show' relationship
-    shows = db.relationship('Show', backref='artist', lazy=True)
+    shows = db.relationship('Show', backref=db.backref('artist', lazy=relationship_loading('Show.artist')),
+                            lazy=relationship_loading('Artist.shows'))
 
     def __repr__(self):
       return f'<Artist ID: {self.id}, name: {self.name}, city: {self.city}, state: {self.state}>'
     
     # This function finds the number of the upcoming shows for an artist
     def upcoming_shows_number(self):
-      # Get all the shows for the artist by his/her ID
-      shows = Show.query.filter_by(artist_id=self.id).all()
-      # Get the current time
-      today = datetime.now()
-      # Initialize the number of shows to zero for each artist
-      num_shows = 0
-      # Loop all the artist's shows
-      for s in shows:
-        # Check if the show is upcoming
-        if s.start_time >= today:
-          # Increase the number of shows
-          num_shows = num_shows + 1
-      return num_shows
+      # Read the maintained counter instead of counting the shows
+      return self.upcoming_shows_count
 
     # This function finds the number of the past shows for an artist
     def past_shows_number(self):
-      # Get all the shows for the artist by his/her ID
-      shows = Show.query.filter_by(artist_id=self.id).all()
-      # Get the current time
-      today = datetime.now()
-      # Initialize the number of shows to zero for each artist
-      num_shows = 0
-      # Loop all the artist's shows
-      for s in shows:
-        # Check if the show is upcoming
-        if s.start_time < today:
-          # Increase the number of shows
-          num_shows = num_shows + 1
-      return num_shows
+      # Read the maintained counter instead of counting the shows
+      return self.past_shows_count
 
     # This function finds all the upcoming shows for an artist
     def upcoming_shows(self):
-      # Get all the shows for the artist by his/her ID
-      shows = Show.query.filter_by(artist_id=self.id).all()
-      # Get the current time
-      today = datetime.now()
-      # Initialize the shows list
-      shows_list = []
-      # Loop all the artist's shows
-      for s in shows:
-        # Check if the show is upcoming
-        if s.start_time >= today:
-          # Add the show in the shows list
-          shows_list.append(s)
-      return shows_list
+      # Let the database filter the artist's shows by the current time
+      return Show.query.filter(Show.artist_id == self.id,
+                               Show.start_time >= datetime.now()).all()
 
     # This function finds all the past shows for an artist
     def past_shows(self):
-      # Get all the shows for the artist by his/her ID
-      shows = Show.query.filter_by(artist_id=self.id).all()
-      # Get the current time
-      today = datetime.now()
-      # Initialize the shows list
-      shows_list = []
-      # Loop all the artist's shows
-      for s in shows:
-        # Check if the show is upcoming
-        if s.start_time < today:
-          # Add the show in the shows list
-          shows_list.append(s)
-      return shows_list
+      # Let the database filter the artist's shows by the current time
+      return Show.query.filter(Show.artist_id == self.id,
+                               Show.start_time < datetime.now()).all()
 
     # This function gets all the genres of the artist
     def genres_types(self):
@@ -277,6 +271,11 @@ class Artist(db.Model):
 """
 class Artists_Genres(db.Model):
     __tablename__ = 'artists_genres'
+    # The trigram index used by the search on PostgreSQL (see the migration 'b1d4f2a7c903')
+    __table_args__ = (
+        db.Index('ix_artists_genres_genre_trgm', 'genre', postgresql_using='gin',
+                 postgresql_ops={'genre': 'gin_trgm_ops'}),
+    )
 
     # This is to define the foreign key of the 'Artist' model
     artist_id = db.Column(db.Integer, db.ForeignKey(
@@ -299,6 +298,13 @@ class Artists_Genres(db.Model):
 """
 class Show(db.Model):
     __tablename__ = 'shows'
+    # The indexes of the shows of a venue or an artist (ordered by their start time),
+    # and of all the shows ordered by their start time (see the migration 'c7e2a91f4b58')
+    __table_args__ = (
+        db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_shows_start_time', 'start_time'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     # This is to define the foreign key of the 'Venue' model
@@ -308,24 +314,1311 @@ class Show(db.Model):
     artist_id = db.Column(db.Integer, db.ForeignKey(
         'artists.id'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
+    # The end of the show: the shows of a venue (or an artist) can't overlap (see 'Schedule conflicts'),
+    # and on PostgreSQL the exclusion constraints of the migration 'a4c81e9d5f20' enforce it
+    end_time = db.Column(db.DateTime, nullable=False)
+    # The time (UTC) of the last change, used by the conditional requests (see 'Conditional requests')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, server_default=db.func.now())
 
     def __repr__(self):
         return f'<Show ID: {self.id}, venue:{self.venue_id}, artist:{self.artist_id}, start time: {self.start_time}>'
 
+"""
+******************* Notes about the 'Upcoming_Shows' model *******************
+1- It is a maintained projection of the upcoming shows, with the names and the images of their
+    venues and artists, so the shows page, the detail pages and the search read the upcoming shows
+    without joining the venues and the artists (see 'Upcoming shows').
+2- The primary key is the ID of the show.
+"""
+class Upcoming_Shows(db.Model):
+    __tablename__ = 'upcoming_shows'
+    # The indexes of the upcoming shows of a venue or an artist, and of all of them (ordered by
+    # their start time, see the migration '3d6f8a2b4c95')
+    __table_args__ = (
+        db.Index('ix_upcoming_shows_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_upcoming_shows_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_upcoming_shows_start_time', 'start_time', 'show_id'),
+    )
+
+    # This is to define the foreign key of the 'Show' model
+    show_id = db.Column(db.Integer, db.ForeignKey(
+        'shows.id'), primary_key=True)
+    venue_id = db.Column(db.Integer, nullable=False)
+    venue_name = db.Column(db.String(), nullable=False)
+    venue_image_link = db.Column(db.String(500))
+    artist_id = db.Column(db.Integer, nullable=False)
+    artist_name = db.Column(db.String(), nullable=False)
+    artist_image_link = db.Column(db.String(500))
+    start_time = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+      return f'<Upcoming show ID: {self.show_id}, venue:{self.venue_id}, artist:{self.artist_id}, start time: {self.start_time}>'
+
+"""
+******************* Notes about the 'Venues_Calendar' and 'Artists_Calendar' models *******************
+1- They are the day buckets of the calendars: the number of shows of a venue (or an artist) that
+    start on a day, so a month of the calendar is read from at most 31 rows (see 'Availability').
+2- The primary key is a composition of the 'Venue' (or 'Artist') ID and the day, and a day
+    without shows has no row.
+"""
+class Venues_Calendar(db.Model):
+    __tablename__ = 'venues_calendar'
+
+    # This is to define the foreign key of the 'Venue' model
+    venue_id = db.Column(db.Integer, db.ForeignKey(
+        'venues.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    shows_count = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+      return f'<Venue ID: {self.venue_id}, day: {self.day}, shows: {self.shows_count}>'
+
+class Artists_Calendar(db.Model):
+    __tablename__ = 'artists_calendar'
+
+    # This is to define the foreign key of the 'Artist' model
+    artist_id = db.Column(db.Integer, db.ForeignKey(
+        'artists.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    shows_count = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+      return f'<Artist ID: {self.artist_id}, day: {self.day}, shows: {self.shows_count}>'
+
+"""
+******************* Notes about the 'Catalog_Version' model *******************
+1- It has one row: the version of the venues, the artists and the shows, which is incremented by
+    every transaction that changes them, and the time (UTC) of the last change. The conditional
+    requests read it instead of aggregating the tables (see 'Conditional requests').
+"""
+class Catalog_Version(db.Model):
+    __tablename__ = 'catalog_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+      return f'<Catalog version: {self.version}, updated at: {self.updated_at}>'
+
+#----------------------------------------------------------------------------#
+# Show queries.
+#----------------------------------------------------------------------------#
+
+"""
+******************* Notes about the show queries *******************
+1- The upcoming/past split is done by the database (CASE on 'start_time') instead of
+    loading every show and comparing it with the current time in Python.
+2- 'shows_counts' takes many venue or artist IDs at once, so a listing page can get the
+    counts of all its rows with one grouped statement.
+3- The shows of the detail pages are loaded by the loaders below ('load_upcoming_shows' from
+    'Upcoming_Shows' and 'load_past_shows' joined with the other side, artist or venue).
+"""
+
+# This function counts the upcoming and past shows of many venues or artists at once.
+# 'owner_column' is 'Show.venue_id' or 'Show.artist_id' and the result is {id: (upcoming, past)}
+def shows_counts(owner_column, ids):
+  ids = list(ids)
+  # Initialize the counts to zero, so the IDs without shows are in the result too
+  counts = {i: (0, 0) for i in ids}
+  if not ids:
+    return counts
+  # Get the current time
+  today = datetime.now()
+  rows = db.session.query(
+      owner_column,
+      db.func.sum(db.case([(Show.start_time >= today, 1)], else_=0)),
+      db.func.sum(db.case([(Show.start_time < today, 1)], else_=0))
+    ).filter(owner_column.in_(ids)).group_by(owner_column).all()
+  for owner_id, upcoming, past in rows:
+    counts[owner_id] = (int(upcoming or 0), int(past or 0))
+  return counts
+
+#----------------------------------------------------------------------------#
+# Loaders.
+#----------------------------------------------------------------------------#
+
+"""
+******************* Notes about the loaders *******************
+1- A loader takes a list of venue (or artist) IDs and returns {id: value} for all of them with
+    one query ('IN (...)'), so a view declares the data it needs in a 'Batch' (concurrency.py)
+    and gets it with one query per loader, all of them at the same time.
+2- The loaders are module-level functions ('functools.partial' of the generic ones below), so the
+    same loader is the same object in every view and its keys are batched together.
+3- They return plain rows and lists (and detached ORM objects), see the notes of concurrency.py.
+"""
+
+# This function loads the venues (or the artists) by their IDs: {id: object or None}
+def load_rows(model, ids):
+  rows = {i: None for i in ids}
+  for row in model.query.filter(model.id.in_(ids)).all():
+    rows[row.id] = row
+  return rows
+
+# This function loads the genres of the venues (or the artists): {id: [genre, ...]}
+def load_genres(genres_model, owner_column, ids):
+  genres = {i: [] for i in ids}
+  for owner_id, genre in db.session.query(owner_column, genres_model.genre
+      ).filter(owner_column.in_(ids)).order_by(owner_column, genres_model.genre).all():
+    genres[owner_id].append(genre)
+  return genres
+
+# This function loads the upcoming shows of venues (with their artists) or of artists (with their venues)
+# from the projection, where the other side's columns are already there: {id: [show row, ...]}
+def load_upcoming_shows(owner_column, ids):
+  other = 'artist' if owner_column is Show.venue_id else 'venue'
+  owner = getattr(Upcoming_Shows, owner_column.key)
+  shows = {i: [] for i in ids}
+  rows = db.session.query(
+      owner.label('owner_id'),
+      getattr(Upcoming_Shows, other + '_id').label('other_id'),
+      getattr(Upcoming_Shows, other + '_name').label('other_name'),
+      getattr(Upcoming_Shows, other + '_image_link').label('other_image_link'),
+      Upcoming_Shows.start_time
+    ).filter(owner.in_(ids), Upcoming_Shows.start_time >= datetime.now()
+    ).order_by(owner, Upcoming_Shows.start_time).all()
+  for row in rows:
+    shows[row.owner_id].append(row)
+  return shows
+
+# This function loads the past shows of venues (with their artists) or of artists (with their venues),
+# joined with the other side: {id: [show row, ...]}
+def load_past_shows(owner_column, other_model, ids):
+  # The column that joins the show with the other side of the relationship
+  other_column = Show.artist_id if owner_column is Show.venue_id else Show.venue_id
+  shows = {i: [] for i in ids}
+  rows = db.session.query(
+      owner_column.label('owner_id'),
+      other_column.label('other_id'),
+      other_model.name.label('other_name'),
+      other_model.image_link.label('other_image_link'),
+      Show.start_time
+    ).join(other_model, other_model.id == other_column
+    ).filter(owner_column.in_(ids), Show.start_time < datetime.now()
+    ).order_by(owner_column, Show.start_time).all()
+  for row in rows:
+    shows[row.owner_id].append(row)
+  return shows
+
+# This function counts the upcoming shows of venues (or artists) in the projection: {id: count}
+def load_upcoming_counts(owner_column, ids):
+  owner = getattr(Upcoming_Shows, owner_column.key)
+  counts = {i: 0 for i in ids}
+  counts.update(db.session.query(owner, db.func.count()
+    ).filter(owner.in_(ids), Upcoming_Shows.start_time >= datetime.now()).group_by(owner).all())
+  return counts
+
+load_venues = functools.partial(load_rows, Venue)
+load_venues_genres = functools.partial(load_genres, Venues_Genres, Venues_Genres.venue_id)
+load_venues_upcoming_shows = functools.partial(load_upcoming_shows, Show.venue_id)
+load_venues_past_shows = functools.partial(load_past_shows, Show.venue_id, Artist)
+load_venues_upcoming_counts = functools.partial(load_upcoming_counts, Show.venue_id)
+
+load_artists = functools.partial(load_rows, Artist)
+load_artists_genres = functools.partial(load_genres, Artists_Genres, Artists_Genres.artist_id)
+load_artists_upcoming_shows = functools.partial(load_upcoming_shows, Show.artist_id)
+load_artists_past_shows = functools.partial(load_past_shows, Show.artist_id, Venue)
+load_artists_upcoming_counts = functools.partial(load_upcoming_counts, Show.artist_id)
+
+#----------------------------------------------------------------------------#
+# Shows counters.
+#----------------------------------------------------------------------------#
+
+"""
+******************* Notes about the shows counters *******************
+1- The venues and the artists carry the numbers of their upcoming and past shows
+    ('upcoming_shows_count' and 'past_shows_count'), so the listing and search pages read
+    one column instead of counting the shows.
+2- The counters are updated when a show is created ('count_show') and when a venue and its
+    shows are deleted ('recount_shows').
+3- Since the shows become past as time passes, 'flask rollover-shows' (run it periodically,
+    e.g. every hour) recounts the venues and artists whose shows started recently.
+4- 'flask check-shows-counters' recounts every venue and artist from scratch and reports
+    (or fixes with '--fix') the counters that drifted.
+"""
+
+# This function adds (or removes with delta=-1) a show to the counters of its venue and artist
+def count_show(venue_id, artist_id, start_time, delta=1):
+  name = 'upcoming_shows_count' if start_time >= datetime.now() else 'past_shows_count'
+  for model, owner_id in ((Venue, venue_id), (Artist, artist_id)):
+    column = getattr(model, name)
+    # Update the counter in the database (col = col + delta), so concurrent shows are not lost
+    model.query.filter(model.id == owner_id).update({column: column + delta},
+                                                    synchronize_session=False)
+
+# This function recounts the counters of the given venues (or artists) from their shows
+# 'owner_column' is 'Show.venue_id' for the venues and 'Show.artist_id' for the artists
+def recount_shows(model, owner_column, ids):
+  counts = shows_counts(owner_column, ids)
+  if not counts:
+    return
+  catalog_changed()
+  table = model.__table__
+  # Update all the rows with one statement (executemany)
+  db.session.execute(
+    table.update().where(table.c.id == db.bindparam('owner_id')).values(
+      upcoming_shows_count=db.bindparam('upcoming'),
+      past_shows_count=db.bindparam('past')),
+    [{"owner_id": owner_id, "upcoming": upcoming, "past": past}
+     for owner_id, (upcoming, past) in counts.items()])
+
+# This function moves the shows that started since 'since' from the upcoming to the past counters
+def rollover_shows(since):
+  now = datetime.now()
+  started = db.session.query(Show.venue_id, Show.artist_id).filter(
+    Show.start_time >= since, Show.start_time < now).all()
+  venue_ids = set(s.venue_id for s in started)
+  artist_ids = set(s.artist_id for s in started)
+  # Recounting is idempotent, so overlapping rollovers don't count a show twice
+  recount_shows(Venue, Show.venue_id, venue_ids)
+  recount_shows(Artist, Show.artist_id, artist_ids)
+  # Remove the shows that started from the upcoming shows
+  expire_upcoming_shows(now)
+  return len(venue_ids), len(artist_ids)
+
+# This function recounts the counters of all the venues (or artists) and returns the ones that
+# drifted: [(id, (stored upcoming, stored past), (counted upcoming, counted past))]
+def shows_counters_drift(model, owner_column, batch_size=1000):
+  drift = []
+  last_id = 0
+  while True:
+    # Go through the table in batches ordered by ID
+    rows = db.session.query(model.id, model.upcoming_shows_count, model.past_shows_count
+      ).filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+    if not rows:
+      return drift
+    counts = shows_counts(owner_column, [r.id for r in rows])
+    for r in rows:
+      if (r.upcoming_shows_count, r.past_shows_count) != counts[r.id]:
+        drift.append((r.id, (r.upcoming_shows_count, r.past_shows_count), counts[r.id]))
+    last_id = rows[-1].id
+
+#----------------------------------------------------------------------------#
+# Upcoming shows.
+#----------------------------------------------------------------------------#
+
+"""
+******************* Notes about the upcoming shows *******************
+1- 'Upcoming_Shows' is a table maintained by the app (on PostgreSQL and SQLite alike), instead of
+    a materialized view that PostgreSQL can only refresh as a whole.
+2- The upcoming shows of the venues (or the artists) that changed are refreshed from the shows
+    ('refresh_upcoming_shows'): when a show is created, when shows are imported, and when a
+    venue is deleted. Editing a venue (or an artist) updates its name and image in its upcoming
+    shows ('rename_upcoming_shows').
+3- 'flask rollover-shows' also removes the shows that started ('expire_upcoming_shows'), and the
+    readers still compare the start time with the current time, so a show that started since the
+    last rollover isn't listed as upcoming.
+4- 'flask refresh-upcoming-shows' rebuilds the whole table.
+5- The shows page (and '/api/v1/shows') lists the upcoming shows from 'Upcoming_Shows' by default,
+    and the past shows ('?period=past') or all the shows ('?period=all') from 'Show'.
+"""
+
+# The columns of 'Upcoming_Shows', in the order of the query of 'refresh_upcoming_shows'
+UPCOMING_SHOWS_COLUMNS = ['show_id', 'venue_id', 'venue_name', 'venue_image_link',
+                          'artist_id', 'artist_name', 'artist_image_link', 'start_time']
+
+# This function refreshes the upcoming shows of the given venues (or artists) that start between 'start'
+# and 'end' (included, all of them by default). 'owner_column' is 'Show.venue_id' or 'Show.artist_id',
+# and without it (or with 'ids' None) the upcoming shows of all the venues are refreshed
+def refresh_upcoming_shows(owner_column=None, ids=None, start=None, end=None):
+  now = datetime.now()
+  shows = db.session.query(
+      Show.id, Show.venue_id, Venue.name, Venue.image_link,
+      Show.artist_id, Artist.name, Artist.image_link, Show.start_time
+    ).join(Venue, Venue.id == Show.venue_id
+    ).join(Artist, Artist.id == Show.artist_id
+    ).filter(Show.start_time >= max(now, start or now))
+  upcoming_shows = Upcoming_Shows.query
+  if owner_column is not None and ids is not None:
+    ids = list(ids)
+    if not ids:
+      return
+    shows = shows.filter(owner_column.in_(ids))
+    upcoming_shows = upcoming_shows.filter(getattr(Upcoming_Shows, owner_column.key).in_(ids))
+  if start is not None:
+    upcoming_shows = upcoming_shows.filter(Upcoming_Shows.start_time >= start)
+  if end is not None:
+    shows = shows.filter(Show.start_time <= end)
+    upcoming_shows = upcoming_shows.filter(Upcoming_Shows.start_time <= end)
+  # Replace the rows with the shows (idempotent, like 'recount_shows')
+  catalog_changed()
+  upcoming_shows.delete(synchronize_session=False)
+  db.session.execute(Upcoming_Shows.__table__.insert().from_select(UPCOMING_SHOWS_COLUMNS, shows.statement))
+
+# This function sets the name and the image of a venue (or an artist) in its upcoming shows
+# 'owner_column' is 'Show.venue_id' for a venue and 'Show.artist_id' for an artist
+def rename_upcoming_shows(owner_column, owner_id, name, image_link):
+  other = 'venue' if owner_column is Show.venue_id else 'artist'
+  Upcoming_Shows.query.filter(getattr(Upcoming_Shows, owner_column.key) == owner_id).update(
+    {other + '_name': name, other + '_image_link': image_link}, synchronize_session=False)
+
+# This function removes the shows that started before 'now' from the upcoming shows
+def expire_upcoming_shows(now):
+  return Upcoming_Shows.query.filter(Upcoming_Shows.start_time < now).delete(synchronize_session=False)
+
+#----------------------------------------------------------------------------#
+# Schedule conflicts.
+#----------------------------------------------------------------------------#
+
+"""
+******************* Notes about the schedule conflicts *******************
+1- A show takes the time slot [start_time, end_time) of its venue and of its artist, and a new
+    show is rejected if it overlaps another show of the same venue or artist. A show without an
+    end time lasts 'SHOW_DEFAULT_DURATION' minutes.
+2- Since the shows of a venue don't overlap, the only show that can overlap a new one is the
+    last show that starts before the new one ends: one lookup in the index on
+    (venue_id, start_time) (O(log n)), and the same for the artist ('schedule_conflict').
+3- On PostgreSQL, exclusion constraints on (venue_id, tsrange(start_time, end_time)) and on
+    (artist_id, ...) also reject the overlapping shows that are inserted at the same time: the
+    create page then informs the user about the other show like the check before the insert.
+4- A bulk load checks its shows with an in-memory 'ScheduleIndex' (schedule.py), loaded with
+    the existing shows of the batch's venues and artists in the batch's time range.
+"""
+
+# This function returns the end time of a show: its given end time, or its start time plus the default duration
+def show_end_time(start_time, end_time=None):
+  return end_time or start_time + timedelta(minutes=app.config.get('SHOW_DEFAULT_DURATION', 120))
+
+# This function returns the show of the venue (or the artist) that overlaps [start_time, end_time),
+# or None. 'owner_column' is 'Show.venue_id' for a venue and 'Show.artist_id' for an artist
+def schedule_conflict(owner_column, owner_id, start_time, end_time):
+  show = db.session.query(Show.id, Show.start_time, Show.end_time).filter(
+    owner_column == owner_id, Show.start_time < end_time).order_by(Show.start_time.desc()).first()
+  if show is not None and show.end_time > start_time:
+    return show
+  return None
+
+# This function returns the message about the show of the venue or of the artist that overlaps
+# [start_time, end_time), or None if they are both free
+def show_conflict_message(venue_id, artist_id, start_time, end_time):
+  for owner, owner_column, owner_id in (('venue', Show.venue_id, venue_id), ('artist', Show.artist_id, artist_id)):
+    conflict = schedule_conflict(owner_column, owner_id, start_time, end_time)
+    if conflict is not None:
+      return 'The %s id:%d has another show from %s to %s' % (
+        owner, owner_id, format_datetime(conflict.start_time), format_datetime(conflict.end_time))
+  return None
+
+# This function loads the time slots of the shows of the given venues and artists that overlap
+# [start_time, end_time) in a 'ScheduleIndex', with the keys ('venue', id) and ('artist', id)
+def load_schedule(venue_ids, artist_ids, start_time, end_time):
+  index = ScheduleIndex()
+  for kind, owner_column, ids in (('venue', Show.venue_id, venue_ids), ('artist', Show.artist_id, artist_ids)):
+    if not ids:
+      continue
+    shows = db.session.query(owner_column, Show.start_time, Show.end_time).filter(
+      owner_column.in_(ids), Show.start_time < end_time, Show.end_time > start_time)
+    for owner_id, show_start, show_end in shows:
+      index.add((kind, owner_id), show_start, show_end)
+  return index
+
+#----------------------------------------------------------------------------#
+# Genres.
+#----------------------------------------------------------------------------#
+
+# This function sets the genres of a venue (or an artist) and returns True if they changed. Only the
+# differences are written: one DELETE for the removed genres and one multi-row INSERT for the added ones.
+# 'owner_column' is 'Venues_Genres.venue_id' or 'Artists_Genres.artist_id', and 'current' are the
+# genres the venue has now (e.g. none when it is created), they are read from the database by default
+def update_genres(genres_model, owner_column, owner_id, genres, current=None):
+  genres = set(genres)
+  if current is None:
+    # Don't flush the pending changes of the venue yet, so they are written with one UPDATE
+    with db.session.no_autoflush:
+      current = set(r[0] for r in db.session.query(genres_model.genre).filter(owner_column == owner_id))
+  removed = set(current) - genres
+  added = genres - set(current)
+  if removed or added:
+    catalog_changed()
+  if removed:
+    db.session.execute(genres_model.__table__.delete().where(
+      (owner_column == owner_id) & genres_model.genre.in_(removed)))
+  if added:
+    db.session.execute(genres_model.__table__.insert().values(
+      [{owner_column.key: owner_id, "genre": g} for g in sorted(added)]))
+  return bool(removed or added)
+
+#----------------------------------------------------------------------------#
+# Pagination.
+#----------------------------------------------------------------------------#
+
+"""
+******************* Notes about the pagination *******************
+1- The listing pages use keyset pagination: a page starts right after (or before) the
+    ordering values of the last (or first) row of the previous page, so the database can
+    use an index instead of scanning and skipping the rows of all the previous pages (OFFSET).
+2- The cursors are the ordering values of a row encoded as url-safe base64 JSON
+    ('?after=<cursor>' for the next page and '?before=<cursor>' for the previous page).
+3- The page size is 'PAGE_SIZE' in config.py, and the full listing is still available
+    with '?all=1'.
+"""
+
+# This function encodes the ordering values of a row as a cursor
+def encode_cursor(values):
+  values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+  return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+# This function decodes a cursor to the ordering values of the given columns
+def decode_cursor(cursor, columns):
+  try:
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if len(values) != len(columns):
+      raise ValueError(cursor)
+    # The datetime values were converted to strings when the cursor was encoded
+    return [datetime.fromisoformat(v) if isinstance(c.type, db.DateTime) else v
+            for c, v in zip(columns, values)]
+  except (ValueError, TypeError):
+    # The cursor was edited by hand or comes from another page
+    abort(400)
+
+# This function checks if the user asked for the full listing instead of a page
+def full_listing_requested():
+  return request.args.get('all') in ('1', 'true', 'yes')
+
+# The periods of the shows listing ('?period=...'), the upcoming shows by default
+SHOWS_PERIODS = ('upcoming', 'past', 'all')
+
+# This function returns the period of the shows the user asked for: 'upcoming', 'past' or 'all'
+def shows_period():
+  period = request.args.get('period', 'upcoming')
+  if period not in SHOWS_PERIODS:
+    abort(400)
+  return period
+
+# This function returns the URL of another page of the current listing (e.g. page_url(after=cursor)),
+# with the other arguments of the request (e.g. the filters of the availability)
+@app.template_global()
+def page_url(**cursor):
+  args = dict(request.view_args or {})
+  args.update((k, v) for k, v in request.args.items() if k not in ('after', 'before'))
+  args.update(cursor)
+  return url_for(request.endpoint, **args)
+
+# This function makes a query fetch its rows in batches of 'STREAM_BATCH_SIZE' while they are used,
+# instead of loading all of them at once (with a server-side cursor on PostgreSQL)
+def stream_query(query):
+  return query.yield_per(app.config.get('STREAM_BATCH_SIZE', 1000)).execution_options(stream_results=True)
+
+# This function yields the rows of a statement in batches of 'STREAM_BATCH_SIZE' rows,
+# with a server-side cursor on PostgreSQL
+def stream_rows(statement):
+  result = db.session.execute(statement.execution_options(stream_results=True))
+  batch_size = app.config.get('STREAM_BATCH_SIZE', 1000)
+  while True:
+    rows = result.fetchmany(batch_size)
+    if not rows:
+      result.close()
+      return
+    yield rows
+
+# This function returns one page of the query ordered by 'columns' and the cursors of the
+# next and previous pages: (rows, {"next": cursor or None, "prev": cursor or None}).
+# 'key' gets the ordering values (in the same order of 'columns') from a row.
+def keyset_page(query, columns, key):
+  page_size = app.config['PAGE_SIZE']
+  after = request.args.get('after')
+  before = request.args.get('before')
+
+  if before:
+    # Go backward from the cursor and reverse the rows to show them in the normal order
+    values = decode_cursor(before, columns)
+    rows = query.filter(db.tuple_(*columns) < db.tuple_(*values)
+      ).order_by(*[c.desc() for c in columns]).limit(page_size + 1).all()
+    has_more = len(rows) > page_size
+    rows = list(reversed(rows[:page_size]))
+    pages = {
+      "prev": encode_cursor(key(rows[0])) if has_more else None,
+      "next": encode_cursor(key(rows[-1])) if rows else None
+    }
+  else:
+    if after:
+      values = decode_cursor(after, columns)
+      query = query.filter(db.tuple_(*columns) > db.tuple_(*values))
+    # Get one extra row to know if there is a next page
+    rows = query.order_by(*columns).limit(page_size + 1).all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    pages = {
+      "prev": encode_cursor(key(rows[0])) if after and rows else None,
+      "next": encode_cursor(key(rows[-1])) if has_more else None
+    }
+  return rows, pages
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+"""
+******************* Notes about the search *******************
+1- A venue or an artist matches the search term by its name, city, state or genres, and
+    "City, State" (e.g. "San Francisco, CA") matches the venues or artists in that location.
+2- The results are ranked in the database (name > location > genre), and the numbers of their
+    upcoming shows are counted in 'Upcoming_Shows' by a loader, for all the results at once.
+3- On PostgreSQL every 'ILIKE' condition uses a trigram (pg_trgm) GIN index (the migrations
+    'b1d4f2a7c903' and '5e1c7a9d3b24'): the conditions are separate selects combined with
+    'UNION ALL', since an 'OR' of them (or an 'EXISTS' on the genres) makes PostgreSQL scan
+    the whole table. The IDs are then grouped and ranked.
+4- On SQLite the same query runs, but 'LIKE %term%' can't use a B-tree index, so every select
+    scans its table (SQLite has no trigram indexes; FTS5 would need separate tables).
+"""
+
+# This function escapes the wildcards of the search term and returns the 'ILIKE' pattern
+def like_pattern(term):
+  term = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+  return '%' + term + '%'
+
+# This function searches the venues (or the artists) and returns the response data dictionary of
+# the search pages: {"count": ..., "data": [{"id": ..., "name": ..., "num_upcoming_shows": ...}]}
+def search(model, genres_model, genres_owner_column, search_term):
+  search_term = (search_term or '').strip()
+  pattern = like_pattern(search_term)
+
+  # Every condition matches one column, so each of them can use its own index, and they are combined
+  # with 'UNION ALL' instead of 'OR' (name: 4, location: 2, genre: 1)
+  matches = [
+    db.select([model.id.label('id'), db.literal(4).label('rank')]).where(model.name.ilike(pattern, escape='\\')),
+    db.select([model.id.label('id'), db.literal(2).label('rank')]).where(model.city.ilike(pattern, escape='\\')),
+    db.select([model.id.label('id'), db.literal(2).label('rank')]).where(model.state.ilike(pattern, escape='\\')),
+    db.select([genres_owner_column.label('id'), db.literal(1).label('rank')]
+      ).where(genres_model.genre.ilike(pattern, escape='\\')),
+  ]
+  # Search by "City, State"
+  if ',' in search_term:
+    city, state = [t.strip() for t in search_term.rsplit(',', 1)]
+    matches.append(db.select([model.id.label('id'), db.literal(2).label('rank')]).where(db.and_(
+      model.city.ilike(like_pattern(city), escape='\\'), model.state.ilike(like_pattern(state), escape='\\'))))
+  matches = db.union_all(*matches).alias('matches')
+  # The ranks are distinct powers of two, so the sum of the distinct ranks of an ID adds every kind of match once
+  ranks = db.session.query(matches.c.id, db.func.sum(db.distinct(matches.c.rank)).label('rank')
+    ).group_by(matches.c.id).subquery()
+
+  results = db.session.query(model.id, model.name).join(ranks, ranks.c.id == model.id
+    ).order_by(ranks.c.rank.desc(), model.name, model.id).all()
+
+  # The upcoming shows of the results are counted in the projection with one grouped query
+  loader = load_venues_upcoming_counts if model is Venue else load_artists_upcoming_counts
+  batch = Batch()
+  batch.need(loader, *[r.id for r in results])
+  counts = batch.resolve()[loader]
+
+  return {
+    "count": len(results),
+    "data": [{"id": r.id, "name": r.name, "num_upcoming_shows": counts[r.id]}
+             for r in results]
+  }
+
+#----------------------------------------------------------------------------#
+# Availability.
+#----------------------------------------------------------------------------#
+
+"""
+******************* Notes about the availability *******************
+1- 'free_venues' finds the venues of a city without shows between two times (optionally with a
+    genre) in one query, paged like the listings: the location uses the index on (state, city),
+    the genre the primary key of 'Venues_Genres', and the shows the index on (venue_id, start_time).
+2- Since the shows of a venue don't overlap (see 'Schedule conflicts'), a venue is busy if one of
+    its shows starts between the two times, or if its last show that starts before them ends after
+    the first one: two index lookups per venue instead of scanning all its shows ('busy_condition').
+3- 'touring_artists' finds the artists with shows in the venues of a state between two times, with
+    the dates of those shows.
+4- The month calendars of the venues and the artists are read from their day buckets
+    ('Venues_Calendar' and 'Artists_Calendar'). The buckets of the days that changed are recounted
+    from the shows ('recount_calendar') when shows are created and when a venue is deleted.
+    A show is counted on the day it starts.
+"""
+
+# The calendar model, its owner column and the owner column of 'Show', by kind
+CALENDARS = {
+  'venue': (Venues_Calendar, Venues_Calendar.venue_id, Show.venue_id),
+  'artist': (Artists_Calendar, Artists_Calendar.artist_id, Show.artist_id)
+}
+
+# This function recounts the day buckets of the given venues (or artists, by 'kind') between the
+# 'start' and 'end' days (included, every day by default). 'ids' is None for all of them
+def recount_calendar(kind, ids, start=None, end=None):
+  model, calendar_column, owner_column = CALENDARS[kind]
+  day = db.func.date(Show.start_time)
+  shows = db.session.query(owner_column, day, db.func.count(Show.id))
+  buckets = model.query
+  if ids is not None:
+    ids = list(ids)
+    if not ids:
+      return
+    shows = shows.filter(owner_column.in_(ids))
+    buckets = buckets.filter(calendar_column.in_(ids))
+  if start is not None:
+    shows = shows.filter(Show.start_time >= datetime.combine(start, datetime.min.time()))
+    buckets = buckets.filter(model.day >= start)
+  if end is not None:
+    shows = shows.filter(Show.start_time < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    buckets = buckets.filter(model.day <= end)
+  # Replace the buckets with the counts of the shows (idempotent, like 'recount_shows')
+  buckets.delete(synchronize_session=False)
+  db.session.execute(model.__table__.insert().from_select(
+    [calendar_column.key, 'day', 'shows_count'], shows.group_by(owner_column, day).statement))
+
+# This function returns the condition "the venue (or the artist) has a show between 'start_time' and
+# 'end_time'" for a query of the venues (or the artists), e.g. busy_condition(Show.venue_id, Venue.id, ...)
+def busy_condition(owner_column, owner_id, start_time, end_time):
+  starts_between = db.exists().where(db.and_(owner_column == owner_id,
+                                             Show.start_time >= start_time, Show.start_time < end_time))
+  previous_end = db.select([Show.end_time]).where(db.and_(owner_column == owner_id, Show.start_time < start_time)
+    ).order_by(Show.start_time.desc()).limit(1).as_scalar()
+  # (a venue without previous shows has no end: NULL, which would make the negated condition NULL too)
+  return db.or_(starts_between, db.func.coalesce(previous_end, start_time) > start_time)
+
+# This function returns one page of the venues of a city that are free between 'start_time' and
+# 'end_time' (and have the genre, if any), and the cursors of the next and previous pages
+def free_venues(city, state, start_time, end_time, genre=None):
+  query = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state, Venue.address, Venue.image_link
+    ).filter(Venue.state == state, Venue.city == city,
+             ~busy_condition(Show.venue_id, Venue.id, start_time, end_time))
+  if genre:
+    query = query.filter(db.exists().where(db.and_(Venues_Genres.venue_id == Venue.id,
+                                                   Venues_Genres.genre == genre)))
+  venues, pages = keyset_page(query, [Venue.name, Venue.id], lambda r: (r.name, r.id))
+  return [{
+    "id": v.id,
+    "name": v.name,
+    "city": v.city,
+    "state": v.state,
+    "address": v.address,
+    "image_link": v.image_link
+  } for v in venues], pages
+
+# This function returns one page of the artists with shows in the venues of a state after 'start_time'
+# (and before 'end_time', if any) with the dates of those shows, and the cursors of the next and previous pages
+def touring_artists(state, start_time, end_time=None, genre=None):
+  in_state = [Show.artist_id == Artist.id, Venue.id == Show.venue_id, Venue.state == state,
+              Show.start_time >= start_time]
+  if end_time is not None:
+    in_state.append(Show.start_time < end_time)
+  query = db.session.query(Artist.id, Artist.name, Artist.city, Artist.state, Artist.image_link
+    ).filter(db.exists().where(db.and_(*in_state)))
+  if genre:
+    query = query.filter(db.exists().where(db.and_(Artists_Genres.artist_id == Artist.id,
+                                                   Artists_Genres.genre == genre)))
+  artists, pages = keyset_page(query, [Artist.name, Artist.id], lambda r: (r.name, r.id))
+
+  # The dates of the shows of the page's artists in the state, with one query
+  dates = {a.id: [] for a in artists}
+  if dates:
+    shows = db.session.query(Show.artist_id, Show.venue_id, Venue.name, Venue.city, Show.start_time, Show.end_time
+      ).join(Venue, Venue.id == Show.venue_id
+      ).filter(Show.artist_id.in_(list(dates)), *in_state[2:]).order_by(Show.artist_id, Show.start_time)
+    for s in shows:
+      dates[s.artist_id].append({
+        "venue_id": s.venue_id,
+        "venue_name": s.name,
+        "venue_city": s.city,
+        # ISO 8601 (the other API responses write the datetimes as 'YYYY-MM-DD HH:MM:SS')
+        "start_time": s.start_time.isoformat(),
+        "end_time": s.end_time.isoformat()
+      })
+  return [{
+    "id": a.id,
+    "name": a.name,
+    "city": a.city,
+    "state": a.state,
+    "image_link": a.image_link,
+    "shows": dates[a.id]
+  } for a in artists], pages
+
+# This function returns the calendar of a month of a venue (or an artist, by 'kind') from its day buckets:
+# {"year": ..., "month": ..., "days": [{"day": "YYYY-MM-DD", "shows_count": ...}]} with every day of the month
+def calendar_month(kind, owner_id, year, month):
+  model, calendar_column, owner_column = CALENDARS[kind]
+  days = [date(year, month, d) for d in range(1, calendar.monthrange(year, month)[1] + 1)]
+  counts = dict(db.session.query(model.day, model.shows_count).filter(
+    calendar_column == owner_id, model.day >= days[0], model.day <= days[-1]))
+  return {
+    "year": year,
+    "month": month,
+    "days": [{"day": d.isoformat(), "shows_count": counts.get(d, 0)} for d in days]
+  }
+
+#----------------------------------------------------------------------------#
+# Detail cache.
+#----------------------------------------------------------------------------#
+
+"""
+******************* Notes about the detail cache *******************
+1- The data of the venue and artist detail pages is cached by the venue (or artist) ID
+    ('venue:<id>' and 'artist:<id>'), and the backend is chosen by 'DETAIL_CACHE_BACKEND' in config.py.
+2- The entries are invalidated by the views that change them: editing a venue (or an artist)
+    changes its page and the pages of the artists (or venues) it has shows with, creating a show
+    changes the pages of its venue and artist, and deleting a venue changes its page and the pages
+    of its artists.
+3- Since an upcoming show becomes past at its start time, an entry expires at the start time of
+    the next upcoming show (or after 'DETAIL_CACHE_TTL' seconds, whichever comes first).
+4- An entry built from a read replica expires after 'REPLICA_CACHE_TTL' seconds at most.
+5- An entry keeps the version of the page it was built for (the same version as the ETag, see
+    'Conditional requests'), and it is rebuilt when the current version is different: the other
+    workers' changes don't invalidate this worker's cache, and the page must not be older than its ETag.
+"""
+
+# This function gets the details of a venue (or an artist) from the cache, or builds them by
+# calling 'builder(owner_id)' and keeps them in the cache with their 'version' (see 'details_version').
+# It returns None if it doesn't exist
+def cached_details(kind, owner_id, builder, version):
+  key = f'{kind}:{owner_id}'
+  entry = detail_cache.get(key)
+  # An entry of another version was built before a change (e.g. made by another worker)
+  if entry is not None and entry[0] == version:
+    data = entry[1]
+  else:
+    details = builder(owner_id)
+    if details is None:
+      return None
+    data, next_show_time = details
+    ttl = app.config.get('DETAIL_CACHE_TTL', 300)
+    # Expire the entry when the next upcoming show becomes past
+    if next_show_time is not None:
+      ttl = min(ttl, (next_show_time - datetime.now()).total_seconds())
+    # A replica can be behind the primary (e.g. right after the entry was invalidated),
+    # so keep the entries built from a replica for less time
+    if using_replica():
+      ttl = min(ttl, app.config.get('REPLICA_CACHE_TTL', 30))
+    if ttl > 0:
+      detail_cache.set(key, (version, data), ttl)
+  return data
+
+# This function removes the details of the given venues and artists from the cache
+def invalidate_details(venue_ids=(), artist_ids=()):
+  detail_cache.delete(*([f'venue:{i}' for i in venue_ids] + [f'artist:{i}' for i in artist_ids]))
+
+#----------------------------------------------------------------------------#
+# Conditional requests.
+#----------------------------------------------------------------------------#
+
+"""
+******************* Notes about the conditional requests *******************
+1- The venues, artists and shows carry the time of their last change ('updated_at').
+2- The listing pages compute their version from 'Catalog_Version', which every transaction that
+    changes the venues, the artists or the shows (including their genres, counters and upcoming
+    shows) increments when it commits, so the version is one lookup by primary key instead of
+    aggregating the tables. The changes are noticed when they are flushed and by the bulk
+    updates and deletes of the ORM ('CATALOG_MODELS'), and the functions that write with SQL
+    statements (e.g. the imports) call 'catalog_changed'.
+3- The ETag is a hash of the version and the URL (the page cursor is part of it), and
+    'Last-Modified' is the time of the last change. If the browser (or the CDN) already has this
+    version, the view answers '304 Not Modified' without building the data or rendering the template.
+4- The detail pages compute their version from the venue (or the artist) and its shows (one
+    query on the index of its shows), and they also depend on the number of upcoming shows,
+    since the upcoming/past split moves with time.
+5- For the same reason, the version of the shows page includes the start time of the next
+    upcoming show (one lookup in the index of 'Upcoming_Shows'): it changes when that show
+    starts, which is when the upcoming and the past shows change.
+6- The version row is updated when the transaction commits (after its other changes), so it is
+    locked for as short as possible and a transaction that holds it doesn't wait for other rows.
+"""
+
+# The models whose changes change the version of the catalog
+CATALOG_MODELS = (Venue, Venues_Genres, Artist, Artists_Genres, Show, Upcoming_Shows)
+
+# This function records that the current transaction changed the catalog, so its version is
+# incremented when it commits
+def catalog_changed(session=None):
+  (session or db.session).info['catalog_changed'] = True
+
+@event.listens_for(RoutingSession, 'before_flush')
+def catalog_flushed(session, flush_context, instances):
+  if any(isinstance(o, CATALOG_MODELS) for o in itertools.chain(session.new, session.dirty, session.deleted)):
+    catalog_changed(session)
+
+@event.listens_for(RoutingSession, 'after_bulk_update')
+@event.listens_for(RoutingSession, 'after_bulk_delete')
+def catalog_bulk_changed(context):
+  if context.mapper.class_ in CATALOG_MODELS:
+    catalog_changed(context.session)
+
+@event.listens_for(RoutingSession, 'before_commit')
+def increment_catalog_version(session):
+  # Flush the pending changes first, since the commit flushes them after this event
+  session.flush()
+  if not session.info.pop('catalog_changed', False):
+    return
+  table = Catalog_Version.__table__
+  values = {"version": table.c.version + 1, "updated_at": datetime.utcnow()}
+  if not session.execute(table.update().where(table.c.id == 1).values(**values)).rowcount:
+    # The database was created without the migrations (e.g. 'db.create_all()')
+    session.execute(table.insert().values(id=1, version=1, updated_at=values["updated_at"]))
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_catalog_changes(session):
+  session.info.pop('catalog_changed', None)
+
+# This function checks the browser's validators ('If-None-Match' and 'If-Modified-Since') against
+# the version of the page, and keeps the page's validators for the response ('set_validators')
+def is_not_modified(version, last_modified):
+  g.etag = hashlib.sha1(repr((request.full_path, version)).encode()).hexdigest()
+  # HTTP dates don't have microseconds
+  g.last_modified = last_modified.replace(microsecond=0) if last_modified else None
+  # A page with flashed messages is not the same page the browser already has
+  if session.get('_flashes'):
+    return False
+  if request.if_none_match:
+    return request.if_none_match.contains(g.etag)
+  if request.if_modified_since and g.last_modified:
+    return g.last_modified <= request.if_modified_since.replace(tzinfo=None)
+  return False
+
+# This function answers '304 Not Modified' with the page's validators
+def not_modified_response():
+  return Response(status=304)
+
+# The version of a listing page: the version of the catalog and the time of its last change
+def listing_version():
+  version = db.session.query(Catalog_Version.version, Catalog_Version.updated_at).filter(
+    Catalog_Version.id == 1).first()
+  if version is None:
+    return (0,), None
+  return (version.version,), version.updated_at
+
+# The version of the shows page: the version of the catalog and the start time of the next
+# upcoming show, since the upcoming shows become past as time passes
+def shows_version():
+  version, last_modified = listing_version()
+  next_start = db.session.query(db.func.min(Upcoming_Shows.start_time)).filter(
+    Upcoming_Shows.start_time >= datetime.now()).scalar()
+  return version + (next_start,), last_modified
+
+# The version of a venue (or artist) page: its latest change, and the latest change, the number
+# of the shows and upcoming shows of the venue and of the artists it has shows with (or the opposite)
+# 'owner_column' is 'Show.venue_id' for a venue and 'Show.artist_id' for an artist
+def details_version(model, owner_column, owner_id, other_model):
+  other_column = Show.artist_id if owner_column is Show.venue_id else Show.venue_id
+  shows = db.session.query(
+      db.func.max(Show.updated_at).label('shows_updated_at'),
+      db.func.max(other_model.updated_at).label('others_updated_at'),
+      db.func.count(Show.id).label('shows_count'),
+      db.func.sum(db.case([(Show.start_time >= datetime.now(), 1)], else_=0)).label('upcoming_count')
+    ).join(other_model, other_model.id == other_column
+    ).filter(owner_column == owner_id).subquery()
+  version = db.session.query(model.updated_at, shows).filter(model.id == owner_id).first()
+  if version is None:
+    return None, None
+  last_modified = max([v for v in version[:2] if v is not None])
+  return tuple(version), last_modified
+
+@app.after_request
+def set_validators(response):
+  # Add the page's validators to the successful responses and make the browser (or the CDN)
+  # revalidate the page before using its copy
+  if response.status_code in (200, 304) and g.get('etag'):
+    response.set_etag(g.etag)
+    if g.last_modified:
+      response.last_modified = g.last_modified
+    response.cache_control.no_cache = True
+  return response
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
+"""
+******************* Notes about the filters *******************
+1- The 'datetime' filter takes the datetime objects of the views (a string is still parsed).
+2- The babel patterns are parsed once per format and the locale once per name (lru_cache),
+    and the datetime is formatted by the compiled pattern directly. This also avoids babel's
+    time zone lookup for the naive datetimes, which failed with "'NoneType' object has no
+    attribute 'days'".
+3- The formatted values are cached too, since many shows of a listing start at the same time.
+"""
+
+# The named formats of the 'datetime' filter
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma"
+}
+
+# The compiled babel pattern of a format (a name of 'DATETIME_FORMATS' or a babel pattern)
+@functools.lru_cache(maxsize=64)
+def datetime_pattern(format):
+  return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format))
+
+@functools.lru_cache(maxsize=16)
+def datetime_locale(name):
+  return babel.Locale.parse(name)
+
+@functools.lru_cache(maxsize=4096)
+def format_datetime_value(value, format, locale):
+  return datetime_pattern(format).apply(value, datetime_locale(locale))
+
 def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+  if not isinstance(value, datetime):
+    value = dateutil.parser.parse(value)
+  return format_datetime_value(value, format, app.config.get('DATETIME_LOCALE', 'en_US'))
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Streamed templates.
+#----------------------------------------------------------------------------#
+
+"""
+******************* Notes about the streamed templates *******************
+1- The listing pages in 'STREAM_TEMPLATES' (config.py) are rendered as a stream: the template
+    is sent in parts while it is rendered, and its data is generated while the rows are
+    fetched in batches ('stream_query'), so the first bytes are sent after the first batch
+    and the memory doesn't grow with the number of rows.
+2- The other pages are rendered in memory by 'render_template' as before.
+3- The session cookie is sent before a streamed template is rendered, so the flashed messages
+    the template reads ('get_flashed_messages') would stay in the session: a listing page with
+    flashed messages is rendered in memory.
+"""
+
+# This function renders a template as a stream (Flask 1.1 doesn't have 'stream_template')
+# (Reference: https://flask.palletsprojects.com/en/1.1.x/patterns/streaming/)
+def stream_template(template_name, **context):
+  app.update_template_context(context)
+  template = app.jinja_env.get_template(template_name)
+  stream = template.stream(context)
+  # Send the rendered template in parts of a few items instead of item by item
+  stream.enable_buffering(app.config.get('STREAM_BUFFER_SIZE', 64))
+  return Response(stream_with_context(stream))
+
+# This function renders a listing page as a stream if its view is in 'STREAM_TEMPLATES'
+def render_listing(template_name, **context):
+  # The flashed messages are removed from the session when the template reads them, so a page
+  # with flashed messages is rendered before the session is saved
+  if request.endpoint in app.config.get('STREAM_TEMPLATES', ()) and not session.get('_flashes'):
+    return stream_template(template_name, **context)
+  return render_template(template_name, **context)
+
+#----------------------------------------------------------------------------#
+# Bulk import.
+#----------------------------------------------------------------------------#
+
+"""
+******************* Notes about the bulk import *******************
+1- 'flask import <venues|artists|shows> FILE' and 'POST /api/v1/import/<venues|artists|shows>'
+    read a CSV or NDJSON file (see bulk.py) and import its rows a batch at a time
+    ('IMPORT_BATCH_SIZE' rows), each batch in its own transaction.
+2- Every row is validated by the same form as the create pages (VenueForm, ArtistForm and
+    ShowForm), without the defaults of their fields (a show without a start time is rejected
+    instead of starting at the current time). The rows that are not valid are reported with
+    their errors and skipped; the other rows of the batch are imported.
+3- The columns of a row are the fields of the form. The genres are a list in NDJSON and are
+    separated by commas in CSV, and 'seeking_talent'/'seeking_venue' are 'Yes' or 'No' (or a
+    boolean in NDJSON). The 'start_time' (and the optional 'end_time') of a show are
+    'YYYY-MM-DD HH:MM:SS', and the shows that overlap another show of their venue or artist are
+    rejected (see 'Schedule conflicts').
+4- A venue (or an artist) can have an 'id', so the shows of the same catalogue can refer to it
+    (import the venues and the artists before their shows). The IDs that already exist are
+    rejected, so importing the same venues twice doesn't duplicate them.
+5- The venues and artists of the shows of a batch are checked with one query each, and their
+    shows counters are recounted once per batch.
+6- The rows are inserted with one multi-row statement per table (executemany), or with 'COPY'
+    on PostgreSQL (when 'IMPORT_COPY' is set). The IDs of the new venues and artists are taken
+    from the sequence beforehand, so their genres are inserted in the same way.
+7- When a batch fails in the database, it is rolled back and the import stops: the rows before
+    it are committed, and the import can be resumed after them ('--skip' or '--checkpoint',
+    or '?skip=' for the endpoint).
+"""
+
+# The columns of a venue (or an artist) taken as they are from its form
+VENUE_FIELDS = ['name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link',
+                'website', 'seeking_description']
+ARTIST_FIELDS = ['name', 'city', 'state', 'phone', 'image_link', 'facebook_link', 'website',
+                 'seeking_description']
+
+# This function converts a row of a file to the form data of a form: the genres are a list and
+# the booleans are 'Yes' or 'No', like the values sent by the create pages
+def import_formdata(row):
+  formdata = MultiDict()
+  for key, value in row.items():
+    if value is None:
+      continue
+    if key == 'genres':
+      if not isinstance(value, list):
+        value = str(value).split(',')
+      formdata.setlist(key, [str(v).strip() for v in value if str(v).strip()])
+    elif isinstance(value, bool):
+      formdata[key] = 'Yes' if value else 'No'
+    else:
+      formdata[key] = str(value)
+  return formdata
+
+# This function validates a row with the form and returns the form's errors (empty if it is valid)
+def validate_row(form, row):
+  if row is None:
+    return {"row": ['Not a JSON object.']}
+  # The same form is reused for all the rows of a batch, without the defaults of its fields
+  # (e.g. the current time for the start time of a show), so a missing value is rejected
+  form.process(import_formdata(row), **{field.name: None for field in form})
+  if not form.validate():
+    return form.errors
+  return {}
+
+# This function parses an ID of a row, or returns None if it isn't a positive integer
+def parse_id(value):
+  try:
+    value = int(value)
+  except (TypeError, ValueError):
+    return None
+  return value if value > 0 else None
+
+# This function takes 'count' new IDs for the rows of a model
+def allocate_ids(model, count):
+  if not count:
+    return []
+  if db.engine.dialect.name == 'postgresql':
+    sequence = db.func.pg_get_serial_sequence(model.__tablename__, 'id')
+    rows = db.session.execute(db.select([db.func.nextval(sequence)]).select_from(
+      db.func.generate_series(1, count)))
+    return [r[0] for r in rows]
+  # SQLite doesn't have sequences: the IDs after the largest one (an import is the only writer)
+  last_id = db.session.query(db.func.coalesce(db.func.max(model.id), 0)).scalar()
+  return list(range(last_id + 1, last_id + count + 1))
+
+# This function moves the sequence of a model after the IDs that were given by the imported rows
+def sync_sequence(model):
+  if db.engine.dialect.name == 'postgresql':
+    db.session.execute(
+      'SELECT setval(pg_get_serial_sequence(:table, \'id\'), '
+      'GREATEST(max(id), nextval(pg_get_serial_sequence(:table, \'id\')))) FROM ' + model.__tablename__,
+      {"table": model.__tablename__})
+
+# This function inserts rows ([{column: value}], all with the same columns) into a table:
+# with 'COPY' on PostgreSQL (if 'IMPORT_COPY' is set), or with one executemany statement
+def insert_rows(table, rows):
+  if not rows:
+    return
+  catalog_changed()
+  if db.engine.dialect.name == 'postgresql' and app.config.get('IMPORT_COPY'):
+    # COPY doesn't apply the defaults of the models: the time of the change is in UTC like the
+    # other writes, not the server default (the time zone of the database session)
+    if 'updated_at' in table.c:
+      now = datetime.utcnow()
+      rows = [dict(row, updated_at=now) for row in rows]
+    columns = list(rows[0].keys())
+    # The cursor of the session's connection, so the rows are in the same transaction
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert('COPY %s (%s) FROM STDIN' % (table.name, ', '.join(columns)),
+                       copy_text(rows, columns))
+  else:
+    db.session.execute(table.insert(), rows)
+
+# This function imports a batch of venues (or artists): [(row number, row)].
+# 'seeking_field' is 'seeking_talent' for the venues and 'seeking_venue' for the artists
+def import_owners(model, form, genres_model, genres_owner_key, fields, seeking_field, rows):
+  valid = []
+  rejected = []
+  for number, row in rows:
+    errors = validate_row(form, row)
+    owner_id = None
+    if not errors and row.get('id') not in (None, ''):
+      owner_id = parse_id(row['id'])
+      if owner_id is None:
+        errors = {"id": ['Not a valid ID.']}
+    if errors:
+      rejected.append({"row": number, "errors": errors})
+      continue
+    values = {f: getattr(form, f).data for f in fields}
+    values[seeking_field] = getattr(form, seeking_field).data == 'Yes'
+    valid.append((number, owner_id, values, form.genres.data))
+
+  # The given IDs that already exist (or repeat in the batch) are rejected
+  given_ids = [v[1] for v in valid if v[1] is not None]
+  existing = set(r[0] for r in db.session.query(model.id).filter(model.id.in_(given_ids))) if given_ids else set()
+  accepted = []
+  for v in valid:
+    if v[1] is not None and v[1] in existing:
+      rejected.append({"row": v[0], "errors": {"id": ['The ID %d already exists.' % v[1]]}})
+    else:
+      existing.add(v[1])
+      accepted.append(v)
+
+  def insert_owners(part, ids):
+    owners = []
+    genres = []
+    for (number, _, values, owner_genres), owner_id in zip(part, ids):
+      owners.append(dict(values, id=owner_id))
+      genres.extend({genres_owner_key: owner_id, "genre": g} for g in set(owner_genres))
+    insert_rows(model.__table__, owners)
+    insert_rows(genres_model.__table__, genres)
+
+  # Insert the rows with a given ID first, so the new IDs are taken after them
+  given = [v for v in accepted if v[1] is not None]
+  new = [v for v in accepted if v[1] is None]
+  if given:
+    insert_owners(given, [v[1] for v in given])
+    sync_sequence(model)
+  if new:
+    insert_owners(new, allocate_ids(model, len(new)))
+  return len(accepted), rejected
+
+# This function imports a batch of shows: [(row number, row)]
+def import_shows(form, rows):
+  valid = []
+  rejected = []
+  for number, row in rows:
+    errors = validate_row(form, row)
+    venue_id = artist_id = None
+    if not errors:
+      venue_id = parse_id(form.venue_id.data)
+      artist_id = parse_id(form.artist_id.data)
+      if venue_id is None:
+        errors["venue_id"] = ['Not a valid ID.']
+      if artist_id is None:
+        errors["artist_id"] = ['Not a valid ID.']
+    if errors:
+      rejected.append({"row": number, "errors": errors})
+      continue
+    valid.append((number, {"venue_id": venue_id, "artist_id": artist_id,
+                           "start_time": form.start_time.data,
+                           "end_time": show_end_time(form.start_time.data, form.end_time.data)}))
+
+  # Check the venues and the artists of the whole batch with one query each
+  venue_ids = set(v[1]["venue_id"] for v in valid)
+  artist_ids = set(v[1]["artist_id"] for v in valid)
+  if venue_ids:
+    venue_ids = set(r[0] for r in db.session.query(Venue.id).filter(Venue.id.in_(venue_ids)))
+  if artist_ids:
+    artist_ids = set(r[0] for r in db.session.query(Artist.id).filter(Artist.id.in_(artist_ids)))
+  # The existing shows of the batch's venues and artists in the batch's time range
+  schedule = ScheduleIndex()
+  if valid:
+    schedule = load_schedule(venue_ids, artist_ids, min(v[1]["start_time"] for v in valid),
+                             max(v[1]["end_time"] for v in valid))
+  shows = []
+  for number, values in valid:
+    errors = {}
+    if values["venue_id"] not in venue_ids:
+      errors["venue_id"] = ['The venue id:%d does not exist' % values["venue_id"]]
+    if values["artist_id"] not in artist_ids:
+      errors["artist_id"] = ['The artist id:%d does not exist' % values["artist_id"]]
+    # Check the show against the existing shows and the previous shows of the file
+    for kind in ('venue', 'artist'):
+      key = (kind, values[kind + "_id"])
+      if not errors and schedule.conflict(key, values["start_time"], values["end_time"]):
+        errors["start_time"] = ['The %s id:%d has another show at this time' % key]
+    if errors:
+      rejected.append({"row": number, "errors": errors})
+    else:
+      schedule.add(('venue', values["venue_id"]), values["start_time"], values["end_time"])
+      schedule.add(('artist', values["artist_id"]), values["start_time"], values["end_time"])
+      shows.append(values)
+  insert_rows(Show.__table__, shows)
+
+  # Recount the counters of the venues and artists of the batch once
+  venue_ids = set(s["venue_id"] for s in shows)
+  artist_ids = set(s["artist_id"] for s in shows)
+  recount_shows(Venue, Show.venue_id, venue_ids)
+  recount_shows(Artist, Show.artist_id, artist_ids)
+  # and the days of the batch in their calendars
+  if shows:
+    first_day = min(s["start_time"] for s in shows).date()
+    last_day = max(s["start_time"] for s in shows).date()
+    recount_calendar('venue', venue_ids, first_day, last_day)
+    recount_calendar('artist', artist_ids, first_day, last_day)
+    # and the upcoming shows of the batch's venues
+    refresh_upcoming_shows(Show.venue_id, venue_ids, min(s["start_time"] for s in shows),
+                           max(s["start_time"] for s in shows))
+  return len(shows), rejected, venue_ids, artist_ids
+
+# This function imports the rows ([(row number, row)]) of a file, and yields a report for every
+# batch: {"first_row", "last_row", "imported", "rejected": [{"row", "errors"}], "error"}
+def import_rows(kind, rows, batch_size=None):
+  batch_size = batch_size or app.config.get('IMPORT_BATCH_SIZE', 1000)
+  # The forms are only used to validate the rows (formdata=None, so they don't read the request)
+  if kind == 'venues':
+    form = VenueForm(formdata=None, meta={'csrf': False})
+  elif kind == 'artists':
+    form = ArtistForm(formdata=None, meta={'csrf': False})
+  elif kind == 'shows':
+    form = ShowForm(formdata=None, meta={'csrf': False})
+  else:
+    raise ValueError('Unknown kind: ' + str(kind))
+
+  for batch in batches(rows, batch_size):
+    report = {"first_row": batch[0][0], "last_row": batch[-1][0], "imported": 0, "rejected": [], "error": None}
+    try:
+      if kind == 'venues':
+        report["imported"], report["rejected"] = import_owners(
+          Venue, form, Venues_Genres, 'venue_id', VENUE_FIELDS, 'seeking_talent', batch)
+      elif kind == 'artists':
+        report["imported"], report["rejected"] = import_owners(
+          Artist, form, Artists_Genres, 'artist_id', ARTIST_FIELDS, 'seeking_venue', batch)
+      else:
+        report["imported"], report["rejected"], venue_ids, artist_ids = import_shows(form, batch)
+      report["rejected"].sort(key=lambda r: r["row"])
+      db.session.commit()
+      if kind == 'shows':
+        # Remove the pages of the shows' venues and artists from the cache
+        invalidate_details(venue_ids=venue_ids, artist_ids=artist_ids)
+    except SQLAlchemyError as e:
+      db.session.rollback()
+      report["imported"] = 0
+      report["error"] = str(getattr(e, 'orig', None) or e)
+    yield report
+    if report["error"]:
+      return
+
+#----------------------------------------------------------------------------#
+# Bulk export.
+#----------------------------------------------------------------------------#
+
+"""
+******************* Notes about the bulk export *******************
+1- 'flask export' and 'GET /api/v1/export/<table>' write the tables of the catalogue (venues,
+    artists, shows and their genres) as CSV, NDJSON or Parquet, optionally compressed with gzip.
+2- The rows are read with a server-side cursor on PostgreSQL ('stream_results') and fetched
+    'STREAM_BATCH_SIZE' rows at a time, and every batch is written before the next one is
+    fetched, so the memory doesn't grow with the size of the table.
+3- An export can be incremental: '--since' (or '?since=') keeps the rows changed since then
+    ('updated_at', in UTC). The genres of a venue (or an artist) are exported when the venue
+    was changed, since its 'updated_at' is set when its genres are edited. The deleted rows are
+    not in an incremental export.
+"""
+
+# The exported tables: name -> (table, the 'updated_at' column of its rows or of their owners)
+EXPORT_TABLES = {
+  'venues': (Venue.__table__, Venue.updated_at),
+  'artists': (Artist.__table__, Artist.updated_at),
+  'shows': (Show.__table__, Show.updated_at),
+  'venues_genres': (Venues_Genres.__table__, Venue.updated_at),
+  'artists_genres': (Artists_Genres.__table__, Artist.updated_at),
+}
+
+# This function exports a table and yields the parts (text or bytes) of the file.
+# The rows are ordered by the primary key, and 'since' keeps the rows changed since then
+def export_table(name, format='csv', since=None, compress=False):
+  table, updated_at = EXPORT_TABLES[name]
+  columns = [c.name for c in table.columns]
+  statement = db.select(table.columns).order_by(*table.primary_key.columns)
+  if since is not None:
+    if updated_at.table is not table:
+      # The genres: join their venue (or artist) to get its time of change
+      owner_column = next(c for c in table.columns if c.foreign_keys)
+      statement = statement.select_from(table.join(updated_at.table, owner_column == updated_at.table.c.id))
+    statement = statement.where(updated_at >= since)
+
+  batches = stream_rows(statement)
+  if format == 'csv':
+    parts = write_csv(batches, columns)
+  elif format == 'ndjson':
+    parts = write_ndjson(batches, columns)
+  elif format == 'parquet':
+    parts = write_parquet(batches, columns, [parquet_type(c.type) for c in table.columns])
+  else:
+    raise ValueError('Unknown format: ' + str(format))
+  return gzip_parts(parts) if compress else parts
+
+# This function returns the file name of an export (e.g. 'venues.csv.gz')
+def export_file_name(name, format, compress):
+  return name + '.' + format + ('.gz' if compress else '')
+
+# This function checks the admin token of the request ('Authorization: Bearer <ADMIN_TOKEN>')
+def require_admin():
+  token = app.config.get('ADMIN_TOKEN')
+  # The admin endpoints are only available when 'ADMIN_TOKEN' is set in config.py
+  if not token:
+    abort(404)
+  if not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+    abort(401)
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -338,85 +1631,70 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
+# This function builds the data of the venues page and returns (areas, pages)
+def venues_data():
+  # Retrieve the venues with their upcoming shows counter in one query,
+  # ordered by their location so the venues of the same city and state come together
+  query = db.session.query(
+      Venue.id, Venue.name, Venue.city, Venue.state, Venue.upcoming_shows_count)
+  columns = [Venue.state, Venue.city, Venue.id]
+
+  if full_listing_requested():
+    # Retrieve all the venues as one stream of plain rows (without the ORM), fetched in batches
+    # while the areas are built
+    all_venues = itertools.chain.from_iterable(stream_rows(query.order_by(*columns).statement))
+    pages = {"prev": None, "next": None}
+  else:
+    # Retrieve one page of venues (the cursor is the location and the ID of a venue)
+    all_venues, pages = keyset_page(query, columns, lambda v: (v.state, v.city, v.id))
+
+  return venues_areas(all_venues), pages
+
+# This function groups the venues (ordered by their location) by their city and state,
+# and yields the locations one by one, so only one location is in memory at a time
+def venues_areas(venues):
+  # Group the consecutive venues of the same city and state
+  for (state, city), area_venues in itertools.groupby(venues, key=lambda v: (v.state, v.city)):
+    yield {"city": city, "state": state, "venues": [
+      {"id": v.id, "name": v.name, "num_upcoming_shows": v.upcoming_shows_count} for v in area_venues]}
+
 @app.route('/venues')
 def venues():
-  # Retrieve all the venues in the database
-  all_venues = Venue.query.all() 
-  
-  # Create a set of cities and states without multiple occurrences of the same element
-  cities_and_states = set()
-  # Retrieve all cities and states from the venues
-  for v in all_venues:
-    cities_and_states.add((v.city, v.state))
-
-  data = [] # Declare the dictionary to store the locations and their venues
-
-  # Loop all the locations (city in state)
-  for location in cities_and_states:
-    venues = [] # Empty the list whenever it is done from a location
-    for v in all_venues:
-      # Find all the venues in the location and add them to the venues list
-      if (v.city == location[0] and v.state == location[1]):
-        # num_shows is aggregated based on the number of upcoming shows per venue 
-        # by calling the function 'upcoming_shows_number'
-        num_shows = v.upcoming_shows_number()
-        # Add the venue to the list
-        venues.append({"id": v.id, "name": v.name,
-                       "num_upcoming_shows": num_shows})
-    # Add the location (city and state) and its venues list to the data
-    data.append({"city": location[0], "state": location[1], "venues": venues})
-
-  return render_template('pages/venues.html', areas=data)
+  # Answer '304 Not Modified' if the browser already has this version of the page
+  if is_not_modified(*listing_version()):
+    return not_modified_response()
+
+  areas, pages = venues_data()
+
+  return render_listing('pages/venues.html', areas=areas, pages=pages)
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
   # Get the 'search_term' the user entered
-  search_term = request.form.get('search_term')
-  # Retrieve all venues by using ilike function for the search term 
-  # (Reference: https://prodevsblog.com/questions/146983/case-insensitive-flask-sqlalchemy-query/)
-  venues = Venue.query.filter(Venue.name.ilike("%" + search_term + "%")).all()
-
-  # Declare the result_venues to store all the venues required details
-  result_venues = []
-
-  # Initilize the count to zero, so it count the result venues
-  count = 0
-
-  # Loop the the venues
-  for v in venues:
-    # Increase the count
-    count = count + 1
-    # Find the venue's upcoming shows count by calling the 'upcoming_shows_number' function
-    upcoming_shows_count = v.upcoming_shows_number()
-    # Add the venue's details to the result_venues data dictionary
-    result_venues.append({
-      "id": v.id,
-      "name": v.name,
-      "num_upcoming_shows": upcoming_shows_count
-    })
-  # Add the count and result_venues to the response data dictionary
-  response={
-    "count": count,
-    "data": result_venues
-  }
+  search_term = request.form.get('search_term', '')
+  # Search the venues by their names, locations and genres by calling the function 'search'
+  response = search(Venue, Venues_Genres, Venues_Genres.venue_id, search_term)
 
   return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
-@app.route('/venues/<int:venue_id>')
-def show_venue(venue_id):
-  # Retrive the venue details from the database by its ID
-  venue = Venue.query.get(venue_id)
-  # Retrive the venue's genres from the database by calling the function 'genres_types'
-  genres = venue.genres_types()
-  
-  # Get the upcoming shows count by calling the function 'upcoming_shows_number'
-  upcoming_shows_count = venue.upcoming_shows_number()
-  # Get the past shows count by calling the function 'past_shows_number'
-  past_shows_count = venue.past_shows_number()
-  # Get the upcoming shows details by calling the function 'upcoming_shows'
-  upcoming_shows = venue.upcoming_shows()
-  # Get the past shows details by calling the function 'past_shows'
-  past_shows = venue.past_shows()
+# This function builds the data of the venue page and returns (data, start time of the next upcoming show),
+# or None if the venue doesn't exist
+def venue_details(venue_id):
+  # Declare the data of the page (the venue, its genres and its upcoming and past shows with their
+  # artists), and load it with one query per loader, all of them at the same time (see concurrency.py)
+  batch = Batch()
+  for loader in (load_venues, load_venues_genres, load_venues_upcoming_shows, load_venues_past_shows):
+    batch.need(loader, venue_id)
+  values = batch.resolve()
+  venue = values[load_venues][venue_id]
+  if venue is None:
+    return None
+  genres = values[load_venues_genres][venue_id]
+  upcoming_shows = values[load_venues_upcoming_shows][venue_id]
+  past_shows = values[load_venues_past_shows][venue_id]
+  # The counts are the lengths of the lists, so there is no need to query them again
+  upcoming_shows_count = len(upcoming_shows)
+  past_shows_count = len(past_shows)
 
   # Declare the 'up_shows_details' and 'past_shows_details' lists
   up_shows_details = []
@@ -426,22 +1704,22 @@ def show_venue(venue_id):
   for us in upcoming_shows:
     # Add the show's details to the 'up_shows_details' dictionary
     up_shows_details.append({
-        "artist_id": us.artist_id,
-        "artist_name": us.artist.name,
-        "artist_image_link": us.artist.image_link,
-        # Converting the datetime object to string (Reference: https://www.programiz.com/python-programming/datetime/current-time)
-        "start_time": us.start_time.strftime("%Y-%m-%d %H:%M:%S")
+        "artist_id": us.other_id,
+        "artist_name": us.other_name,
+        "artist_image_link": us.other_image_link,
+        # The datetime object, formatted by the template's 'datetime' filter
+        "start_time": us.start_time
     })
 
   # Loop all the past shows
   for ps in past_shows:
     # Add the show's details to the 'past_shows_details' dictionary
     past_shows_details.append({
-        "artist_id": ps.artist_id,
-        "artist_name": ps.artist.name,
-        "artist_image_link": ps.artist.image_link,
-        # Converting the datetime object to string (Reference: https://www.programiz.com/python-programming/datetime/current-time)
-        "start_time": ps.start_time.strftime("%Y-%m-%d %H:%M:%S")
+        "artist_id": ps.other_id,
+        "artist_name": ps.other_name,
+        "artist_image_link": ps.other_image_link,
+        # The datetime object, formatted by the template's 'datetime' filter
+        "start_time": ps.start_time
     })
 
   # Add all the required details in the 'data' dictionary
@@ -464,6 +1742,22 @@ def show_venue(venue_id):
     "upcoming_shows_count": upcoming_shows_count
   }
 
+  return data, (upcoming_shows[0].start_time if upcoming_shows else None)
+
+@app.route('/venues/<int:venue_id>')
+def show_venue(venue_id):
+  # Answer '304 Not Modified' if the browser already has this version of the page
+  version, last_modified = details_version(Venue, Show.venue_id, venue_id, Artist)
+  if version is None:
+    abort(404)
+  if is_not_modified(version, last_modified):
+    return not_modified_response()
+
+  # Get the venue details from the cache (or the database) by calling the function 'cached_details'
+  data = cached_details('venue', venue_id, venue_details, version)
+  if data is None:
+    abort(404)
+
   return render_template('pages/show_venue.html', venue=data)
 
 #  Create Venue
@@ -511,11 +1805,9 @@ def create_venue_submission():
                     seeking_talent = seeking_talent,
                     seeking_description=seeking_description)
       db.session.add(venue)
-      # Create instances of the 'Venues_Genres'
-      for g in genres:
-        new_genre = Venues_Genres(genre = g)
-        new_genre.venue = venue
-        db.session.add(new_genre)
+      # Insert the venue to get its ID, then insert all its genres with one statement
+      db.session.flush()
+      update_genres(Venues_Genres, Venues_Genres.venue_id, venue.id, genres, current=())
       db.session.commit()
     except():
       db.session.rollback()
@@ -545,8 +1837,20 @@ def delete_venue(venue_id):
   error = False
   try:
     venue = Venue.query.get(venue_id)
+    # Find the artists that had shows in the venue to recount their shows after deleting them
+    artist_ids = [s.artist_id for s in db.session.query(Show.artist_id).filter(
+      Show.venue_id == venue.id).distinct()]
+    # Delete the venue's shows and genres, since they can't exist without the venue
+    Upcoming_Shows.query.filter(Upcoming_Shows.venue_id == venue.id).delete(synchronize_session=False)
+    Show.query.filter(Show.venue_id == venue.id).delete(synchronize_session=False)
+    Venues_Genres.query.filter(Venues_Genres.venue_id == venue.id).delete(synchronize_session=False)
+    Venues_Calendar.query.filter(Venues_Calendar.venue_id == venue.id).delete(synchronize_session=False)
     db.session.delete(venue)
+    recount_shows(Artist, Show.artist_id, artist_ids)
+    recount_calendar('artist', artist_ids)
     db.session.commit()
+    # Remove the venue's page and the pages of its artists from the cache
+    invalidate_details(venue_ids=[venue_id], artist_ids=artist_ids)
   except():
     db.session.rollback()
     error = True
@@ -566,73 +1870,61 @@ def delete_venue(venue_id):
 
 #  Artists
 #  ----------------------------------------------------------------
+# This function builds the data of the artists page and returns (artists, pages)
+def artists_data():
+  # Retrieve the artists' ids and names from the database
+  query = db.session.query(Artist.id, Artist.name)
+
+  if full_listing_requested():
+    # Retrieve all the artists in batches while they are used
+    artists = stream_query(query.order_by(Artist.id))
+    pages = {"prev": None, "next": None}
+  else:
+    # Retrieve one page of artists (the cursor is the ID of an artist)
+    artists, pages = keyset_page(query, [Artist.id], lambda a: (a.id,))
+
+  # The artists' ids and names, generated one by one while the page is rendered
+  data = ({"id": a.id, "name": a.name} for a in artists)
+
+  return data, pages
+
 @app.route('/artists')
 def artists():
-  # Retrieve all artists details from the database
-  artists = Artist.query.all()
+  # Answer '304 Not Modified' if the browser already has this version of the page
+  if is_not_modified(*listing_version()):
+    return not_modified_response()
 
-  data = []  # Declare the dictionary to store the artists' ids and names
-
-  # Loop all the artists
-  for a in artists:
-    # Add the artist's id and name to the data dictionary
-    data.append({
-      "id": a.id,
-      "name": a.name
-    })
+  artists, pages = artists_data()
 
-  return render_template('pages/artists.html', artists=data)
+  return render_listing('pages/artists.html', artists=artists, pages=pages)
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
   # Get the 'search_term' the user entered
-  search_term = request.form.get('search_term')
+  search_term = request.form.get('search_term', '')
+  # Search the artists by their names, locations and genres by calling the function 'search'
+  response = search(Artist, Artists_Genres, Artists_Genres.artist_id, search_term)
 
-  # Retrieve all artists by using ilike function for the search term
-  # (Reference: https://prodevsblog.com/questions/146983/case-insensitive-flask-sqlalchemy-query/)
-  artists = Artist.query.filter(Artist.name.ilike("%" + search_term + "%")).all()
-  
-  # Declare the result_artists to store all the artists' required details
-  result_artists = []
-
-  # Initilize the count to zero, so it count the result artists
-  count = 0
-
-  # Loop the the venues
-  for a in artists:
-    # Increase the count
-    count = count + 1
-    # Find the artist's upcoming shows count by calling the 'upcoming_shows_number' function
-    upcoming_shows_count = a.upcoming_shows_number()
-    # Add the artist's details to the result_artists data dictionary
-    result_artists.append({
-        "id": a.id,
-        "name": a.name,
-        "num_upcoming_shows": upcoming_shows_count
-    })
-
-  # Add the count and result_artists to the response data dictionary
-  response = {
-      "count": count,
-      "data": result_artists
-  }
   return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
-@app.route('/artists/<int:artist_id>')
-def show_artist(artist_id):
-  # Retrive the artist details from the database by his/her ID
-  artist = Artist.query.get(artist_id)
-  # Retrive the artist's genres from the database by calling the function 'genres_types'
-  genres = artist.genres_types()
-
-  # Get the upcoming shows count by calling the function 'upcoming_shows_number'
-  upcoming_shows_count = artist.upcoming_shows_number()
-  # Get the past shows count by calling the function 'past_shows_number'
-  past_shows_count = artist.past_shows_number()
-  # Get the upcoming shows details by calling the function 'upcoming_shows'
-  upcoming_shows = artist.upcoming_shows()
-  # Get the past shows details by calling the function 'past_shows'
-  past_shows = artist.past_shows()
+# This function builds the data of the artist page and returns (data, start time of the next upcoming show),
+# or None if the artist doesn't exist
+def artist_details(artist_id):
+  # Declare the data of the page (the artist, its genres and its upcoming and past shows with their
+  # venues), and load it with one query per loader, all of them at the same time (see concurrency.py)
+  batch = Batch()
+  for loader in (load_artists, load_artists_genres, load_artists_upcoming_shows, load_artists_past_shows):
+    batch.need(loader, artist_id)
+  values = batch.resolve()
+  artist = values[load_artists][artist_id]
+  if artist is None:
+    return None
+  genres = values[load_artists_genres][artist_id]
+  upcoming_shows = values[load_artists_upcoming_shows][artist_id]
+  past_shows = values[load_artists_past_shows][artist_id]
+  # The counts are the lengths of the lists, so there is no need to query them again
+  upcoming_shows_count = len(upcoming_shows)
+  past_shows_count = len(past_shows)
 
   # Declare the 'up_shows_details' and 'past_shows_details' lists
   up_shows_details = []
@@ -642,22 +1934,22 @@ def show_artist(artist_id):
   for us in upcoming_shows:
     # Add the show's details to the 'up_shows_details' dictionary
     up_shows_details.append({
-        "venue_id": us.venue_id,
-        "venue_name": us.venue.name,
-        "venue_image_link": us.venue.image_link,
-        # Converting the datetime object to string (Reference: https://www.programiz.com/python-programming/datetime/current-time)
-        "start_time": us.start_time.strftime("%Y-%m-%d %H:%M:%S")
+        "venue_id": us.other_id,
+        "venue_name": us.other_name,
+        "venue_image_link": us.other_image_link,
+        # The datetime object, formatted by the template's 'datetime' filter
+        "start_time": us.start_time
     })
 
   # Loop all the past shows
   for ps in past_shows:
     # Add the show's details to the 'past_shows_details' dictionary
     past_shows_details.append({
-        "venue_id": ps.venue_id,
-        "venue_name": ps.venue.name,
-        "venue_image_link": ps.venue.image_link,
-        # Converting the datetime object to string (Reference: https://www.programiz.com/python-programming/datetime/current-time)
-        "start_time": ps.start_time.strftime("%Y-%m-%d %H:%M:%S")
+        "venue_id": ps.other_id,
+        "venue_name": ps.other_name,
+        "venue_image_link": ps.other_image_link,
+        # The datetime object, formatted by the template's 'datetime' filter
+        "start_time": ps.start_time
     })
 
   # Add all the required details in the 'data' dictionary
@@ -679,6 +1971,22 @@ def show_artist(artist_id):
     "upcoming_shows_count": upcoming_shows_count
   }
 
+  return data, (upcoming_shows[0].start_time if upcoming_shows else None)
+
+@app.route('/artists/<int:artist_id>')
+def show_artist(artist_id):
+  # Answer '304 Not Modified' if the browser already has this version of the page
+  version, last_modified = details_version(Artist, Show.artist_id, artist_id, Venue)
+  if version is None:
+    abort(404)
+  if is_not_modified(version, last_modified):
+    return not_modified_response()
+
+  # Get the artist details from the cache (or the database) by calling the function 'cached_details'
+  data = cached_details('artist', artist_id, artist_details, version)
+  if data is None:
+    abort(404)
+
   return render_template('pages/show_artist.html', artist=data)
 
 #  Update
@@ -742,19 +2050,19 @@ def edit_artist_submission(artist_id):
       artist.website=website
       artist.seeking_venue=seeking_venue
       artist.seeking_description=seeking_description
-
-      # Delete all genres to avoid duplicating
-      old_genres = artist.genres
-      for og in old_genres:
-        db.session.delete(og)
-
-      # Add new genres to the database
-      for g in genres:
-        new_genre = Artists_Genres(genre=g)
-        new_genre.artist = artist
-        db.session.add(new_genre)
-
+      # Write only the genres that were removed or added
+      if update_genres(Artists_Genres, Artists_Genres.artist_id, artist_id, genres):
+        # The genres are in another table, so set the time of the change explicitly
+        artist.updated_at = datetime.utcnow()
+
+      # Find the venues the artist has shows in, since their pages show the artist's name and image
+      venue_ids = [s.venue_id for s in db.session.query(Show.venue_id).filter(
+        Show.artist_id == artist_id).distinct()]
+      # and the upcoming shows too
+      rename_upcoming_shows(Show.artist_id, artist.id, name, image_link)
       db.session.commit()
+      # Remove the changed pages from the cache
+      invalidate_details(venue_ids=venue_ids, artist_ids=[artist_id])
     except():
       db.session.rollback()
       error = True
@@ -838,19 +2146,19 @@ def edit_venue_submission(venue_id):
       venue.website = website
       venue.seeking_talent = seeking_talent
       venue.seeking_description = seeking_description
-
-      # Delete all genres to avoid duplicating
-      old_genres = venue.genres
-      for og in old_genres:
-        db.session.delete(og)
-
-      # Add new genres to the database
-      for g in genres:
-        new_genre = Venues_Genres(genre=g)
-        new_genre.venue = venue
-        db.session.add(new_genre)
-
+      # Write only the genres that were removed or added
+      if update_genres(Venues_Genres, Venues_Genres.venue_id, venue_id, genres):
+        # The genres are in another table, so set the time of the change explicitly
+        venue.updated_at = datetime.utcnow()
+
+      # Find the artists that have shows in the venue, since their pages show the venue's name and image
+      artist_ids = [s.artist_id for s in db.session.query(Show.artist_id).filter(
+        Show.venue_id == venue_id).distinct()]
+      # and the upcoming shows too
+      rename_upcoming_shows(Show.venue_id, venue.id, name, image_link)
       db.session.commit()
+      # Remove the changed pages from the cache
+      invalidate_details(venue_ids=[venue_id], artist_ids=artist_ids)
     except():
       db.session.rollback()
       error = True
@@ -916,11 +2224,9 @@ def create_artist_submission():
                       seeking_venue=seeking_venue,
                       seeking_description=seeking_description)
       db.session.add(artist)
-      # Create instances of the 'Artists_Genres'
-      for g in genres:
-        new_genre = Artists_Genres(genre=g)
-        new_genre.artist = artist
-        db.session.add(new_genre)
+      # Insert the artist to get its ID, then insert all its genres with one statement
+      db.session.flush()
+      update_genres(Artists_Genres, Artists_Genres.artist_id, artist.id, genres, current=())
       db.session.commit()
     except():
       db.session.rollback()
@@ -945,25 +2251,60 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
+# This function builds the data of the shows page and returns (shows, pages)
+def shows_data():
+  period = shows_period()
+  if period != 'upcoming':
+    # Retrieve the past shows (or all the shows) with only the venue and artist columns the page needs,
+    # joined in one query instead of loading the venue and the artist of every show separately
+    query = db.session.query(
+        Show.id, Show.start_time,
+        Show.venue_id, Venue.name.label('venue_name'),
+        Show.artist_id, Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link')
+      ).join(Venue, Venue.id == Show.venue_id
+      ).join(Artist, Artist.id == Show.artist_id)
+    if period == 'past':
+      query = query.filter(Show.start_time < datetime.now())
+    columns = [Show.start_time, Show.id]
+  else:
+    # Retrieve the upcoming shows from the projection, where the venue and artist columns are already there
+    query = db.session.query(
+        Upcoming_Shows.show_id.label('id'), Upcoming_Shows.start_time,
+        Upcoming_Shows.venue_id, Upcoming_Shows.venue_name,
+        Upcoming_Shows.artist_id, Upcoming_Shows.artist_name, Upcoming_Shows.artist_image_link
+      ).filter(Upcoming_Shows.start_time >= datetime.now())
+    columns = [Upcoming_Shows.start_time, Upcoming_Shows.show_id]
+
+  if full_listing_requested():
+    # Retrieve all shows details from the database in batches while they are used
+    shows = stream_query(query.order_by(*columns))
+    pages = {"prev": None, "next": None}
+  else:
+    # Retrieve one page of shows (the cursor is the start time and the ID of a show)
+    shows, pages = keyset_page(query, columns, lambda s: (s.start_time, s.id))
+
+  # The shows' details, generated one by one while the page is rendered
+  data = ({
+      "venue_id": s.venue_id,
+      "venue_name": s.venue_name,
+      "artist_id": s.artist_id,
+      "artist_name": s.artist_name,
+      "artist_image_link": s.artist_image_link,
+      # The datetime object, formatted by the template's 'datetime' filter
+      "start_time": s.start_time
+    } for s in shows)
+
+  return data, pages
+
 @app.route('/shows')
 def shows():
-  # Retrieve all shows details from the database
-  shows = Show.query.all()
-
-  data = [] 
-
-  for s in shows:
-    data.append({
-      "venue_id": s.venue.id,
-      "venue_name": s.venue.name,
-      "artist_id": s.artist.id,
-      "artist_name": s.artist.name,
-      "artist_image_link": s.artist.image_link,
-      # Converting the datetime object to string (Reference: https://www.programiz.com/python-programming/datetime/current-time)
-      "start_time": s.start_time.strftime("%Y-%m-%d %H:%M:%S")
-    })
+  # Answer '304 Not Modified' if the browser already has this version of the page
+  if is_not_modified(*shows_version()):
+    return not_modified_response()
 
-  return render_template('pages/shows.html', shows=data)
+  shows, pages = shows_data()
+
+  return render_listing('pages/shows.html', shows=shows, pages=pages, period=shows_period())
 
 @app.route('/shows/create')
 def create_shows():
@@ -999,13 +2340,42 @@ def create_show_submission():
       # Redirect to the new_show.html page with the error message in the above line
       return redirect(url_for('create_show_submission'))
 
+    # Check if the venue or the artist has another show at the same time
+    end_time = show_end_time(form.start_time.data, form.end_time.data)
+    conflict = show_conflict_message(venue.id, artist.id, form.start_time.data, end_time)
+    if conflict is not None:
+      # Inform the user about the show at the same time
+      flash(conflict)
+      return redirect(url_for('create_show_submission'))
+    venue_id, artist_id = venue.id, artist.id
+
     try:
       # Create an instance of the 'Show' with the form data
       show = Show(venue_id=venue_id,
                   artist_id=artist_id,
-                  start_time=start_time)
+                  # The validated datetime object, so the show is counted by the same value that is stored
+                  start_time=form.start_time.data,
+                  end_time=end_time)
       db.session.add(show)
+      # Add the show to the counters of the venue and the artist in the same transaction
+      count_show(venue.id, artist.id, form.start_time.data)
+      # and to the day of the venue's and the artist's calendars (written first, to be counted)
+      db.session.flush()
+      day = form.start_time.data.date()
+      recount_calendar('venue', [venue.id], day, day)
+      recount_calendar('artist', [artist.id], day, day)
+      # and to the upcoming shows
+      refresh_upcoming_shows(Show.venue_id, [venue.id], form.start_time.data, form.start_time.data)
       db.session.commit()
+      # Remove the pages of the show's venue and artist from the cache
+      invalidate_details(venue_ids=[venue.id], artist_ids=[artist.id])
+    except IntegrityError:
+      # Another show of the venue or the artist was added after the check above, and the exclusion
+      # constraint of the database rejected this one (see 'Schedule conflicts')
+      db.session.rollback()
+      flash(show_conflict_message(venue_id, artist_id, form.start_time.data, end_time) or
+            'The venue id:%d or the artist id:%d has another show at the same time' % (venue_id, artist_id))
+      return redirect(url_for('create_show_submission'))
     except():
       db.session.rollback()
       error = True
@@ -1027,12 +2397,288 @@ def create_show_submission():
     return redirect(url_for('create_show_submission'))
 
 
+#  API
+#  ----------------------------------------------------------------
+
+"""
+******************* Notes about the API *******************
+1- Every page has a JSON mirror under '/api/v1/...' built by the same data functions.
+2- The listings (venues, artists and shows) are streamed: as one JSON document sent in chunks
+    ('{"pages": ..., "<items>": [...]}'), or as NDJSON (one item per line) with '?format=ndjson'
+    or 'Accept: application/x-ndjson'. The cursors of the next and previous pages are also in
+    the 'Link' header.
+3- The API answers '304 Not Modified' exactly like the pages.
+4- The availability of the venues and the artists and their month calendars are only in the
+    API (see 'Availability'). Their times (in the arguments and in the responses) are ISO 8601
+    (e.g. '2030-01-01T20:00:00'), while the other responses keep 'YYYY-MM-DD HH:MM:SS'. The times
+    of the arguments can have a UTC offset (e.g. '2030-01-01T20:00Z'), they are then converted to UTC.
+"""
+
+# The size of the chunks of a streamed response
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# The JSON encoder of the API: the datetimes are written as 'YYYY-MM-DD HH:MM:SS'
+class APIJSONEncoder(JSONEncoder):
+    def default(self, o):
+      if isinstance(o, datetime):
+        return o.isoformat(' ')
+      return super().default(o)
+
+app.json_encoder = APIJSONEncoder
+
+# This function groups the small strings of a generator into chunks of about 'STREAM_CHUNK_SIZE'
+def chunked(parts):
+  buffer = []
+  size = 0
+  for part in parts:
+    buffer.append(part)
+    size = size + len(part)
+    if size >= STREAM_CHUNK_SIZE:
+      yield ''.join(buffer)
+      buffer = []
+      size = 0
+  if buffer:
+    yield ''.join(buffer)
+
+# This function checks if the client asked for NDJSON instead of JSON
+def ndjson_requested():
+  if request.args.get('format') == 'ndjson':
+    return True
+  best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+  return best == 'application/x-ndjson'
+
+# This function streams a list of items as JSON ('{"pages": ..., key: [...]}') or as NDJSON
+def stream_json(key, items, pages):
+  if ndjson_requested():
+    parts = (json.dumps(item, cls=APIJSONEncoder) + '\n' for item in items)
+    mimetype = 'application/x-ndjson'
+  else:
+    def json_parts():
+      yield '{"pages": ' + json.dumps(pages) + ', ' + json.dumps(key) + ': ['
+      for i, item in enumerate(items):
+        yield (', ' if i else '') + json.dumps(item, cls=APIJSONEncoder)
+      yield ']}'
+    parts = json_parts()
+    mimetype = 'application/json'
+
+  response = Response(stream_with_context(chunked(parts)), mimetype=mimetype)
+  # Add the cursors of the next and previous pages to the 'Link' header
+  links = []
+  if pages.get("next"):
+    links.append('<' + page_url(after=pages["next"]) + '>; rel="next"')
+  if pages.get("prev"):
+    links.append('<' + page_url(before=pages["prev"]) + '>; rel="prev"')
+  if links:
+    response.headers['Link'] = ', '.join(links)
+  return response
+
+@app.route('/api/v1/venues')
+def api_venues():
+  if is_not_modified(*listing_version()):
+    return not_modified_response()
+  areas, pages = venues_data()
+  return stream_json('areas', areas, pages)
+
+@app.route('/api/v1/venues/search')
+def api_search_venues():
+  return jsonify(search(Venue, Venues_Genres, Venues_Genres.venue_id, request.args.get('search_term', '')))
+
+@app.route('/api/v1/venues/<int:venue_id>')
+def api_show_venue(venue_id):
+  version, last_modified = details_version(Venue, Show.venue_id, venue_id, Artist)
+  if version is None:
+    abort(404)
+  if is_not_modified(version, last_modified):
+    return not_modified_response()
+  return jsonify(cached_details('venue', venue_id, venue_details, version))
+
+@app.route('/api/v1/artists')
+def api_artists():
+  if is_not_modified(*listing_version()):
+    return not_modified_response()
+  artists, pages = artists_data()
+  return stream_json('artists', artists, pages)
+
+@app.route('/api/v1/artists/search')
+def api_search_artists():
+  return jsonify(search(Artist, Artists_Genres, Artists_Genres.artist_id, request.args.get('search_term', '')))
+
+@app.route('/api/v1/artists/<int:artist_id>')
+def api_show_artist(artist_id):
+  version, last_modified = details_version(Artist, Show.artist_id, artist_id, Venue)
+  if version is None:
+    abort(404)
+  if is_not_modified(version, last_modified):
+    return not_modified_response()
+  return jsonify(cached_details('artist', artist_id, artist_details, version))
+
+@app.route('/api/v1/shows')
+def api_shows():
+  if is_not_modified(*shows_version()):
+    return not_modified_response()
+  shows, pages = shows_data()
+  return stream_json('shows', shows, pages)
+
+#  Availability
+#  ----------------------------------------------------------------
+
+# This function reads a datetime from the query string (e.g. '?start=2030-01-01T20:00:00'),
+# it aborts with '400 Bad Request' if it is invalid, or missing and required. A datetime with a
+# UTC offset (e.g. '2030-01-01T20:00Z') is converted to UTC without the offset, like the stored ones
+def datetime_arg(name, required=False):
+  value = request.args.get(name)
+  if not value:
+    if required:
+      abort(400)
+    return None
+  try:
+    value = dateutil.parser.parse(value)
+    if value.tzinfo is not None:
+      value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+  except (ValueError, OverflowError):
+    abort(400)
+
+# The venues of a city that are free between two times, e.g.
+# '/api/v1/availability/venues?city=San Francisco&state=CA&start=2030-01-01T18:00&end=2030-01-01T23:00&genre=Jazz'
+@app.route('/api/v1/availability/venues')
+def api_free_venues():
+  city = request.args.get('city')
+  state = request.args.get('state')
+  start_time = datetime_arg('start', required=True)
+  end_time = datetime_arg('end', required=True)
+  if not city or not state or end_time <= start_time:
+    abort(400)
+  venues, pages = free_venues(city, state, start_time, end_time, request.args.get('genre'))
+  return stream_json('venues', venues, pages)
+
+# The artists with shows in a state (from now by default), e.g.
+# '/api/v1/availability/artists?state=CA&start=2030-01-01T00:00&end=2030-02-01T00:00'
+@app.route('/api/v1/availability/artists')
+def api_touring_artists():
+  state = request.args.get('state')
+  start_time = datetime_arg('start') or datetime.now()
+  end_time = datetime_arg('end')
+  if not state or (end_time is not None and end_time <= start_time):
+    abort(400)
+  artists, pages = touring_artists(state, start_time, end_time, request.args.get('genre'))
+  return stream_json('artists', artists, pages)
+
+@app.route('/api/v1/venues/<int:venue_id>/calendar/<int:year>/<int:month>')
+def api_venue_calendar(venue_id, year, month):
+  if not 1 <= month <= 12 or not 1 <= year <= 9999:
+    abort(404)
+  if db.session.query(Venue.id).filter(Venue.id == venue_id).scalar() is None:
+    abort(404)
+  return jsonify(calendar_month('venue', venue_id, year, month))
+
+@app.route('/api/v1/artists/<int:artist_id>/calendar/<int:year>/<int:month>')
+def api_artist_calendar(artist_id, year, month):
+  if not 1 <= month <= 12 or not 1 <= year <= 9999:
+    abort(404)
+  if db.session.query(Artist.id).filter(Artist.id == artist_id).scalar() is None:
+    abort(404)
+  return jsonify(calendar_month('artist', artist_id, year, month))
+
+#  Admin
+#  ----------------------------------------------------------------
+
+# The formats of the uploaded files by their content type
+UPLOAD_FORMATS = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson'}
+
+# Imports an uploaded CSV or NDJSON file (see 'Bulk import'), sent as the request's body or as
+# the 'file' of a multipart form, and streams the report of every batch as NDJSON.
+# The last line is the summary, with the number of rows to skip to resume the import.
+@app.route('/api/v1/import/<kind>', methods=['POST'])
+@csrf.exempt
+def api_import(kind):
+  require_admin()
+  if kind not in ('venues', 'artists', 'shows'):
+    abort(404)
+  upload = request.files.get('file')
+  if upload is not None:
+    stream = upload.stream
+    format = request.args.get('format') or format_from_name(upload.filename or '')
+  else:
+    stream = request.stream
+    format = request.args.get('format') or UPLOAD_FORMATS.get(request.mimetype)
+  if format not in FORMATS:
+    abort(400)
+  skip = request.args.get('skip', 0, type=int)
+  # Decode the file while it is read, so it isn't loaded in memory
+  rows = read_rows(codecs.getreader('utf-8')(stream), format, skip)
+
+  def reports():
+    summary = {"imported": 0, "rejected": 0, "committed_rows": skip, "error": None}
+    for report in import_rows(kind, rows):
+      summary["imported"] += report["imported"]
+      summary["rejected"] += len(report["rejected"])
+      if report["error"]:
+        summary["error"] = report["error"]
+      else:
+        summary["committed_rows"] = report["last_row"]
+      yield json.dumps(report) + '\n'
+    yield json.dumps(summary) + '\n'
+
+  return Response(stream_with_context(reports()), mimetype='application/x-ndjson')
+
+# Exports a table as CSV, NDJSON or Parquet (see 'Bulk export'), e.g.
+# '/api/v1/export/shows?format=ndjson&since=2020-06-01T00:00:00&gzip=1'
+@app.route('/api/v1/export/<name>')
+def api_export(name):
+  require_admin()
+  if name not in EXPORT_TABLES:
+    abort(404)
+  format = request.args.get('format', 'csv')
+  if format not in EXPORT_FORMATS:
+    abort(400)
+  # An invalid (or out of range) date is a '400 Bad Request' (see 'datetime_arg')
+  since = datetime_arg('since')
+  compress = request.args.get('gzip') == '1'
+
+  mimetypes = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson', 'parquet': 'application/octet-stream'}
+  response = Response(stream_with_context(export_table(name, format, since, compress)),
+                      mimetype='application/gzip' if compress else mimetypes[format])
+  response.headers['Content-Disposition'] = 'attachment; filename=' + export_file_name(name, format, compress)
+  return response
+
+#  Debug
+#  ----------------------------------------------------------------
+
+@app.route('/_debug/cache')
+def debug_cache():
+  # The debug endpoints are only available when 'DEBUG_ENDPOINTS' is set in config.py
+  if not app.config.get('DEBUG_ENDPOINTS'):
+    abort(404)
+  return jsonify(detail_cache.stats())
+
+@app.route('/_debug/queries')
+def debug_queries():
+  # The debug endpoints are only available when 'DEBUG_ENDPOINTS' is set in config.py
+  if not app.config.get('DEBUG_ENDPOINTS'):
+    abort(404)
+  return jsonify(queries.report())
+
+@app.route('/_debug/pool')
+def debug_pool():
+  # The debug endpoints are only available when 'DEBUG_ENDPOINTS' is set in config.py
+  if not app.config.get('DEBUG_ENDPOINTS'):
+    abort(404)
+  return jsonify(pool_stats(db.engine.pool))
+
+
 @app.errorhandler(404)
 def not_found_error(error):
+    # The API answers with JSON
+    if request.path.startswith('/api/'):
+        return jsonify({"error": "not found"}), 404
     return render_template('errors/404.html'), 404
 
 @app.errorhandler(500)
 def server_error(error):
+    # The API answers with JSON
+    if request.path.startswith('/api/'):
+        return jsonify({"error": "server error"}), 500
     return render_template('errors/500.html'), 500
 
 
@@ -1046,6 +2692,104 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+# Moves the shows that started in the last hours from the upcoming to the past counters
+# (e.g. run 'flask rollover-shows' every hour, the overlapping windows are harmless)
+@app.cli.command('rollover-shows')
+@click.option('--hours', default=24, show_default=True,
+              help='Recount the venues and artists with shows that started in the last hours.')
+def rollover_shows_command(hours):
+  venues_count, artists_count = rollover_shows(datetime.now() - timedelta(hours=hours))
+  db.session.commit()
+  click.echo(f'Recounted the shows of {venues_count} venues and {artists_count} artists.')
+
+# Recounts the shows of every venue and artist and reports the counters that drifted
+@app.cli.command('check-shows-counters')
+@click.option('--fix', is_flag=True, help='Update the counters that drifted.')
+def check_shows_counters_command(fix):
+  drifted = 0
+  for model, owner_column in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+    drift = shows_counters_drift(model, owner_column)
+    for owner_id, stored, counted in drift:
+      click.echo(f'{model.__name__} {owner_id}: stored (upcoming, past) = {stored}, counted = {counted}')
+    if fix:
+      recount_shows(model, owner_column, [d[0] for d in drift])
+    drifted = drifted + len(drift)
+  db.session.commit()
+  click.echo(f'{drifted} counters drifted' + (' and were fixed.' if fix and drifted else '.'))
+  if drifted and not fix:
+    raise SystemExit(1)
+
+# Rebuilds the upcoming shows (see 'Upcoming shows')
+@app.cli.command('refresh-upcoming-shows')
+def refresh_upcoming_shows_command():
+  refresh_upcoming_shows()
+  db.session.commit()
+  count = db.session.query(db.func.count(Upcoming_Shows.show_id)).scalar()
+  click.echo(f'Refreshed {count} upcoming shows.')
+
+# Imports a CSV or NDJSON file of venues, artists or shows (see 'Bulk import')
+# (e.g. 'flask import venues venues.csv --checkpoint venues.checkpoint')
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', type=click.Choice(FORMATS), help='The format of the file (by default, its extension).')
+@click.option('--batch-size', type=int, help='The number of rows per transaction (by default, IMPORT_BATCH_SIZE).')
+@click.option('--skip', default=0, help='Skip the first rows (e.g. the rows committed by an interrupted import).')
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help='Keep the number of committed rows in this file, and resume after them.')
+def import_command(kind, file, format, batch_size, skip, checkpoint):
+  format = format or format_from_name(file.name)
+  if format is None:
+    raise click.UsageError('Unknown format, use --format.')
+  if checkpoint and os.path.exists(checkpoint):
+    with open(checkpoint) as f:
+      skip = max(skip, json.load(f)["committed_rows"])
+    click.echo(f'Resuming after row {skip}.')
+
+  imported = 0
+  rejected = 0
+  for report in import_rows(kind, read_rows(file, format, skip), batch_size):
+    for r in report["rejected"]:
+      click.echo(f'Row {r["row"]} rejected: {json.dumps(r["errors"])}', err=True)
+    if report["error"]:
+      click.echo(f'Rows {report["first_row"]}-{report["last_row"]} failed and were rolled back: {report["error"]}', err=True)
+      click.echo(f'Fix them and resume with --skip {skip}.', err=True)
+      raise SystemExit(1)
+    imported = imported + report["imported"]
+    rejected = rejected + len(report["rejected"])
+    skip = report["last_row"]
+    if checkpoint:
+      with open(checkpoint, 'w') as f:
+        json.dump({"committed_rows": skip}, f)
+    click.echo(f'Rows {report["first_row"]}-{report["last_row"]}: {report["imported"]} imported, {len(report["rejected"])} rejected.')
+  click.echo(f'{imported} {kind} imported, {rejected} rows rejected.')
+
+# Exports the tables of the catalogue to files (see 'Bulk export')
+# (e.g. 'flask export --format parquet --gzip --since 2020-06-01T00:00:00 --output-dir exports')
+@app.cli.command('export')
+@click.argument('tables', nargs=-1, type=click.Choice(list(EXPORT_TABLES)))
+@click.option('--format', default='csv', show_default=True, type=click.Choice(EXPORT_FORMATS))
+@click.option('--since', help='Only the rows changed since this time (ISO 8601, UTC).')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the files with gzip.')
+@click.option('--output-dir', default='.', show_default=True, type=click.Path(file_okay=False))
+def export_command(tables, format, since, compress, output_dir):
+  if since:
+    since = dateutil.parser.parse(since)
+  # The start of this export is the '--since' of the next incremental export
+  started_at = datetime.utcnow()
+  os.makedirs(output_dir, exist_ok=True)
+  for name in tables or EXPORT_TABLES:
+    path = os.path.join(output_dir, export_file_name(name, format, compress))
+    with open(path, 'wb') as f:
+      for part in export_table(name, format, since or None, compress):
+        f.write(part.encode('utf-8') if isinstance(part, str) else part)
+    click.echo(f'Exported {name} to {path}.')
+  click.echo(f'Next --since: {started_at.isoformat()}')
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
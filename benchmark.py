@@ -0,0 +1,486 @@
+"""
+******************* Notes about the benchmark *******************
+1- It seeds the database with synthetic venues, artists, shows and genres at a given scale
+    (e.g. '--shows 1000' to '--shows 1000000'), with a realistic skew: a few venues and
+    artists have most of the shows (Zipf-like weights), and the shows are spread over the
+    past and the next year.
+2- It drives every route through the Flask test client and reports, per route: the latency
+    percentiles, the time to the first byte, the queries per request (from the query
+    instrumentation) and the peak memory of one request (tracemalloc).
+3- The results are JSON ('--output'), so two commits can be compared with '--compare'
+    (it exits with 1 if a route got slower than '--threshold').
+4- '--micro' runs the micro-benchmarks instead (no database needed), e.g. the formatting of the
+    start times and the rendering of a page of 10k shows.
+5- It runs on SQLite by default, or on any database given by '--database-url'
+    (e.g. a local PostgreSQL database). '--reset' drops and recreates the tables first.
+6- '--load' runs a load test instead: the app is served by serve.py in the sync and the gevent
+    modes with the same number of workers ('--workers'), and '--clients' clients send the
+    read-only requests at the same time. It reports the throughput and the latency percentiles
+    of each mode (the gevent mode needs the gevent and psycogreen packages).
+
+Examples:
+  python benchmark.py --reset --shows 10000 --output bench.json
+  python benchmark.py --database-url postgresql://localhost/fyyur_bench --reset --shows 1000000
+  python benchmark.py --compare bench.json --output new.json
+  python benchmark.py --micro
+  python benchmark.py --database-url postgresql://localhost/fyyur_bench --load --workers 4 --clients 64
+"""
+import argparse
+import bisect
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from schedule import ScheduleIndex
+
+GENRES = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk',
+          'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop',
+          'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul', 'Other']
+STATES = ['CA', 'NY', 'TX', 'FL', 'IL', 'WA', 'MA', 'CO', 'GA', 'OR']
+
+def parse_args(argv=None):
+  parser = argparse.ArgumentParser(description='Benchmark the Fyyur routes.')
+  parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', 'sqlite:///benchmark.db'))
+  parser.add_argument('--reset', action='store_true', help='Drop, recreate and seed the tables.')
+  parser.add_argument('--shows', type=int, default=10000, help='The number of shows to seed.')
+  parser.add_argument('--venues', type=int, help='The number of venues to seed (by default, a venue per 20 shows).')
+  parser.add_argument('--seed', type=int, default=42, help='The random seed of the data.')
+  parser.add_argument('--requests', type=int, default=20, help='The number of requests per route.')
+  parser.add_argument('--routes', default='', help='Only the routes whose names contain this text.')
+  parser.add_argument('--cache', action='store_true', help='Keep the detail cache enabled.')
+  parser.add_argument('--micro', action='store_true', help='Run the micro-benchmarks instead of the routes.')
+  parser.add_argument('--load', action='store_true',
+                      help='Load-test the app served in the sync and gevent modes instead of the routes.')
+  parser.add_argument('--modes', default='sync,gevent', help='The serving modes of the load test.')
+  parser.add_argument('--workers', type=int, default=2, help='The number of worker processes of the load test.')
+  parser.add_argument('--clients', type=int, default=32,
+                      help='The number of clients of the load test (each one sends --requests requests).')
+  parser.add_argument('--port', type=int, default=5099, help='The port of the server of the load test.')
+  parser.add_argument('--output', help='Write the results (JSON) to this file.')
+  parser.add_argument('--compare', help='Compare the results with a previous results file.')
+  parser.add_argument('--threshold', type=float, default=0.2,
+                      help='The relative p50 slowdown reported as a regression.')
+  return parser.parse_args(argv)
+
+# This function returns weights that give most of the shows to a few venues (or artists)
+def zipf_cum_weights(n, s=1.1):
+  return list(itertools.accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+def seed(fyyur, shows_count, rng, venues_count=None, batch_size=10000):
+  db = fyyur.db
+  venues_count = venues_count or max(shows_count // 20, 10)
+  artists_count = max(shows_count // 10, 10)
+  cities = ['City %d' % i for i in range(max(venues_count // 8, 1))]
+
+  # Venues and artists (their counters are set after the shows)
+  def insert(table, rows):
+    for batch in range(0, len(rows), batch_size):
+      db.session.execute(table.insert(), rows[batch:batch + batch_size])
+
+  insert(fyyur.Venue.__table__, [{
+    "id": i, "name": 'Venue %d' % i, "city": rng.choice(cities), "state": rng.choice(STATES),
+    "address": '%d Main St' % i, "phone": '555-%04d' % (i % 10000),
+    "image_link": 'https://example.com/venues/%d.jpg' % i, "seeking_talent": rng.random() < 0.3
+  } for i in range(1, venues_count + 1)])
+  insert(fyyur.Artist.__table__, [{
+    "id": i, "name": 'Artist %d' % i, "city": rng.choice(cities), "state": rng.choice(STATES),
+    "phone": '555-%04d' % (i % 10000), "image_link": 'https://example.com/artists/%d.jpg' % i,
+    "seeking_venue": rng.random() < 0.3
+  } for i in range(1, artists_count + 1)])
+  insert(fyyur.Venues_Genres.__table__, [{"venue_id": i, "genre": g}
+    for i in range(1, venues_count + 1) for g in rng.sample(GENRES, rng.randint(1, 3))])
+  insert(fyyur.Artists_Genres.__table__, [{"artist_id": i, "genre": g}
+    for i in range(1, artists_count + 1) for g in rng.sample(GENRES, rng.randint(1, 3))])
+
+  # Shows, over the past and the next year
+  venue_weights = zipf_cum_weights(venues_count)
+  artist_weights = zipf_cum_weights(artists_count)
+  now = datetime.now()
+  venue_counts = {}
+  artist_counts = {}
+  # The shows of a venue (or an artist) don't overlap (see 'Schedule conflicts' in app.py),
+  # so a show that overlaps another show of its venue or artist is drawn again
+  schedule = ScheduleIndex()
+  for batch in range(0, shows_count, batch_size):
+    rows = []
+    for i in range(batch + 1, min(batch + batch_size, shows_count) + 1):
+      while True:
+        venue_id = bisect.bisect(venue_weights, rng.random() * venue_weights[-1]) + 1
+        artist_id = bisect.bisect(artist_weights, rng.random() * artist_weights[-1]) + 1
+        start_time = now + timedelta(minutes=rng.randint(-525600, 525600))
+        end_time = start_time + timedelta(hours=2)
+        if (schedule.conflict(('venue', venue_id), start_time, end_time) is None and
+            schedule.conflict(('artist', artist_id), start_time, end_time) is None):
+          break
+      schedule.add(('venue', venue_id), start_time, end_time)
+      schedule.add(('artist', artist_id), start_time, end_time)
+      upcoming = start_time >= now
+      for counts, owner_id in ((venue_counts, venue_id), (artist_counts, artist_id)):
+        upcoming_count, past_count = counts.get(owner_id, (0, 0))
+        counts[owner_id] = (upcoming_count + upcoming, past_count + (not upcoming))
+      rows.append({"id": i, "venue_id": venue_id, "artist_id": artist_id, "start_time": start_time,
+                   "end_time": end_time})
+    db.session.execute(fyyur.Show.__table__.insert(), rows)
+
+  # The maintained counters of the venues and artists
+  for model, counts in ((fyyur.Venue, venue_counts), (fyyur.Artist, artist_counts)):
+    if not counts:
+      continue
+    table = model.__table__
+    db.session.execute(
+      table.update().where(table.c.id == db.bindparam('owner_id')).values(
+        upcoming_shows_count=db.bindparam('upcoming'), past_shows_count=db.bindparam('past')),
+      [{"owner_id": i, "upcoming": u, "past": p} for i, (u, p) in counts.items()])
+  # The day buckets of the calendars
+  fyyur.recount_calendar('venue', None)
+  fyyur.recount_calendar('artist', None)
+  # The upcoming shows
+  fyyur.refresh_upcoming_shows()
+  db.session.commit()
+  return venues_count, artists_count
+
+# The routes: (name, method, path, form data, config changes)
+def routes(venues_count, artists_count, rng):
+  hot_venue = 1
+  hot_artist = 1
+  cold_venue = rng.randint(venues_count // 2, venues_count)
+  cold_artist = rng.randint(artists_count // 2, artists_count)
+  return [
+    ('home', 'GET', '/', None, {}),
+    ('venues', 'GET', '/venues', None, {}),
+    ('venues_all', 'GET', '/venues?all=1', None, {}),
+    ('venues_all_rendered', 'GET', '/venues?all=1', None, {'STREAM_TEMPLATES': set()}),
+    ('artists', 'GET', '/artists', None, {}),
+    ('artists_all', 'GET', '/artists?all=1', None, {}),
+    ('shows', 'GET', '/shows', None, {}),
+    ('shows_all', 'GET', '/shows?all=1', None, {}),
+    ('shows_all_rendered', 'GET', '/shows?all=1', None, {'STREAM_TEMPLATES': set()}),
+    ('venue_hot', 'GET', '/venues/%d' % hot_venue, None, {}),
+    ('venue_cold', 'GET', '/venues/%d' % cold_venue, None, {}),
+    ('artist_hot', 'GET', '/artists/%d' % hot_artist, None, {}),
+    ('artist_cold', 'GET', '/artists/%d' % cold_artist, None, {}),
+    ('search_venues', 'POST', '/venues/search', {"search_term": 'Venue 1'}, {}),
+    ('search_venues_location', 'POST', '/venues/search', {"search_term": 'City 1, CA'}, {}),
+    ('search_artists', 'POST', '/artists/search', {"search_term": 'jazz'}, {}),
+    ('api_venues', 'GET', '/api/v1/venues', None, {}),
+    ('api_shows_all', 'GET', '/api/v1/shows?all=1&format=ndjson', None, {}),
+    ('api_venue_hot', 'GET', '/api/v1/venues/%d' % hot_venue, None, {}),
+  ]
+
+# This function returns the paths of the read-only requests of the load test
+def load_paths(venues_count, artists_count, rng):
+  paths = [path for name, method, path, data, config in routes(venues_count, artists_count, rng)
+           if method == 'GET' and not config and 'all=1' not in path and name != 'home']
+  return paths + ['/api/v1/venues/search?search_term=Venue+1', '/api/v1/artists/search?search_term=jazz']
+
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)]
+
+# This function sends one request and returns (status, time to the first byte, total time)
+def timed_request(client, method, path, data):
+  start = time.perf_counter()
+  response = client.open(path, method=method, data=data, buffered=False)
+  body = iter(response.response)
+  first = next(body, b'')
+  ttfb = time.perf_counter() - start
+  for _ in body:
+    pass
+  total = time.perf_counter() - start
+  response.close()
+  return response.status_code, ttfb, total
+
+def run_route(fyyur, client, route, requests):
+  name, method, path, data, config = route
+  previous = {key: fyyur.app.config.get(key) for key in config}
+  fyyur.app.config.update(config)
+  try:
+    # A warm-up request, then the measured requests
+    timed_request(client, method, path, data)
+    fyyur.queries.reset()
+    latencies = []
+    ttfbs = []
+    for _ in range(requests):
+      status, ttfb, total = timed_request(client, method, path, data)
+      latencies.append(total * 1000)
+      ttfbs.append(ttfb * 1000)
+    report = fyyur.queries.report()
+    queries = sum(v["queries"] for v in report.values()) / float(requests)
+
+    # The peak memory of one request (measured apart, since tracemalloc slows down the requests)
+    tracemalloc.start()
+    timed_request(client, method, path, data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+  finally:
+    fyyur.app.config.update(previous)
+
+  return {
+    "status": status,
+    "p50_ms": round(percentile(latencies, 50), 3),
+    "p90_ms": round(percentile(latencies, 90), 3),
+    "p99_ms": round(percentile(latencies, 99), 3),
+    "mean_ms": round(sum(latencies) / len(latencies), 3),
+    "ttfb_p50_ms": round(percentile(ttfbs, 50), 3),
+    "queries_per_request": round(queries, 2),
+    "peak_memory_kb": round(peak / 1024.0, 1)
+  }
+
+# This function prints the routes that got slower than the threshold and returns their number
+def compare(results, previous, threshold):
+  regressions = 0
+  for name, result in sorted(results["routes"].items()):
+    old = previous.get("routes", {}).get(name)
+    if not old:
+      continue
+    change = (result["p50_ms"] - old["p50_ms"]) / old["p50_ms"] if old["p50_ms"] else 0
+    flag = ''
+    if change > threshold:
+      flag = '  <-- REGRESSION'
+      regressions = regressions + 1
+    print('%-24s p50 %9.2f ms -> %9.2f ms (%+.0f%%), queries %6.2f -> %6.2f%s' % (
+      name, old["p50_ms"], result["p50_ms"], change * 100,
+      old["queries_per_request"], result["queries_per_request"], flag))
+  return regressions
+
+# This function waits until the server answers (or exits with its error)
+def wait_for_server(server, url, timeout=30):
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    if server.poll() is not None:
+      sys.exit('The server stopped with the code %d' % server.returncode)
+    try:
+      urllib.request.urlopen(url, timeout=1).close()
+      return
+    except OSError:
+      time.sleep(0.2)
+  sys.exit('The server did not start in %d seconds' % timeout)
+
+# This function serves the app with serve.py in a mode and sends the requests of the clients at the
+# same time. It returns the throughput and the latency percentiles
+def load_test(args, mode, paths):
+  env = dict(os.environ, DATABASE_URL=args.database_url)
+  if not args.cache:
+    env['DETAIL_CACHE_BACKEND'] = 'null'
+  base_url = 'http://127.0.0.1:%d' % args.port
+  server = subprocess.Popen([sys.executable, 'serve.py', '--mode', mode, '--workers', str(args.workers),
+                             '--port', str(args.port)], cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+  try:
+    wait_for_server(server, base_url + paths[0])
+
+    # Every client sends its requests one after the other, going through the paths
+    def client(number):
+      latencies = []
+      errors = 0
+      for i in range(args.requests):
+        start = time.perf_counter()
+        try:
+          with urllib.request.urlopen(base_url + paths[(number + i) % len(paths)]) as response:
+            response.read()
+        except OSError:
+          errors = errors + 1
+          continue
+        latencies.append((time.perf_counter() - start) * 1000)
+      return latencies, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as executor:
+      results = list(executor.map(client, range(args.clients)))
+    elapsed = time.perf_counter() - start
+  finally:
+    server.terminate()
+    server.wait()
+
+  latencies = [l for r in results for l in r[0]]
+  return {
+    "workers": args.workers,
+    "clients": args.clients,
+    "requests": len(latencies),
+    "errors": sum(r[1] for r in results),
+    "throughput_rps": round(len(latencies) / elapsed, 1),
+    "p50_ms": round(percentile(latencies, 50), 3) if latencies else None,
+    "p90_ms": round(percentile(latencies, 90), 3) if latencies else None,
+    "p99_ms": round(percentile(latencies, 99), 3) if latencies else None
+  }
+
+# This function returns the best time (in ms) of a few runs of a function
+def best_time(function, runs=5):
+  times = []
+  for _ in range(runs):
+    start = time.perf_counter()
+    function()
+    times.append((time.perf_counter() - start) * 1000)
+  return round(min(times), 3)
+
+# The micro-benchmarks: the formatting of the start times of a page of 'count' shows
+def micro_benchmarks(fyyur, rng, count=10000):
+  import babel.dates
+  import dateutil.parser
+  # The shows start on the hour in the next year, so many of them start at the same time
+  now = datetime.now().replace(minute=0, second=0, microsecond=0)
+  start_times = [now + timedelta(days=rng.randint(0, 365), hours=rng.randint(18, 23)) for _ in range(count)]
+  shows = [{"venue_id": 1, "venue_name": 'Venue', "artist_id": 1, "artist_name": 'Artist',
+            "artist_image_link": 'https://example.com/a.jpg', "start_time": t} for t in start_times]
+  pattern = fyyur.DATETIME_FORMATS['full']
+
+  def strings_parsed():
+    # The previous path: a string from the view, parsed again and formatted by babel
+    for t in start_times:
+      babel.dates.format_datetime(dateutil.parser.parse(t.strftime('%Y-%m-%d %H:%M:%S')), pattern, locale='en_US')
+
+  def filter_cold():
+    fyyur.format_datetime_value.cache_clear()
+    for t in start_times:
+      fyyur.format_datetime(t, 'full')
+
+  def filter_warm():
+    for t in start_times:
+      fyyur.format_datetime(t, 'full')
+
+  def render_page():
+    with fyyur.app.test_request_context('/shows'):
+      fyyur.render_template('pages/shows.html', shows=shows, pages={})
+
+  return {
+    "shows": count,
+    "distinct_start_times": len(set(start_times)),
+    "format_strings_parsed_ms": best_time(strings_parsed, 3),
+    "format_filter_cold_ms": best_time(filter_cold),
+    "format_filter_warm_ms": best_time(filter_warm),
+    "render_shows_page_ms": best_time(render_page, 3)
+  }
+
+# This function returns the peak memory (in KB) of a function
+def peak_memory(function):
+  tracemalloc.start()
+  try:
+    function()
+    return round(tracemalloc.get_traced_memory()[1] / 1024.0, 1)
+  finally:
+    tracemalloc.stop()
+
+# The peak memory of grouping all the venues by area: by loading the Venue objects and building
+# all the areas (as the venues page did before), and by grouping one ordered stream of rows
+# (e.g. 'python benchmark.py --reset --shows 0 --venues 100000 --routes venues_memory')
+def venues_memory(fyyur):
+  def orm_areas():
+    with fyyur.app.app_context():
+      areas = {}
+      for v in fyyur.Venue.query.order_by(fyyur.Venue.state, fyyur.Venue.city).all():
+        areas.setdefault((v.city, v.state), []).append(
+          {"id": v.id, "name": v.name, "num_upcoming_shows": v.upcoming_shows_count})
+      return [{"city": c, "state": s, "venues": venues} for (c, s), venues in areas.items()]
+
+  def streamed_areas():
+    with fyyur.app.test_request_context('/venues?all=1'):
+      areas, pages = fyyur.venues_data()
+      for area in areas:
+        pass
+
+  return {
+    "venues_orm_peak_kb": peak_memory(orm_areas),
+    "venues_streamed_peak_kb": peak_memory(streamed_areas)
+  }
+
+def write_results(results, output):
+  if output:
+    with open(output, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+  else:
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+def git_commit():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                   cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def main(argv=None):
+  args = parse_args(argv)
+  # The app reads its database URL when it is imported
+  os.environ['DATABASE_URL'] = args.database_url
+  import app as fyyur
+  from cache import NullCache
+
+  fyyur.app.config['WTF_CSRF_ENABLED'] = False
+  if not args.cache:
+    # Measure the queries of the pages, not the cache
+    fyyur.detail_cache = NullCache()
+  rng = random.Random(args.seed)
+
+  if args.micro:
+    results = {
+      "meta": {"commit": git_commit(), "date": datetime.utcnow().isoformat(), "python": platform.python_version()},
+      "micro": micro_benchmarks(fyyur, rng)
+    }
+    write_results(results, args.output)
+    return
+
+  with fyyur.app.app_context():
+    if args.reset:
+      fyyur.db.drop_all()
+      fyyur.db.create_all()
+      start = time.perf_counter()
+      venues_count, artists_count = seed(fyyur, args.shows, rng, args.venues)
+      print('Seeded %d shows, %d venues and %d artists in %.1f s' % (
+        args.shows, venues_count, artists_count, time.perf_counter() - start), file=sys.stderr)
+    else:
+      venues_count = fyyur.Venue.query.count()
+      artists_count = fyyur.Artist.query.count()
+    shows_count = fyyur.Show.query.count()
+    dialect = fyyur.db.engine.dialect.name
+
+  client = fyyur.app.test_client()
+  results = {
+    "meta": {
+      "commit": git_commit(),
+      "date": datetime.utcnow().isoformat(),
+      "database": dialect,
+      "shows": shows_count,
+      "venues": venues_count,
+      "artists": artists_count,
+      "requests": args.requests,
+      "python": platform.python_version()
+    },
+    "routes": {}
+  }
+
+  if args.load:
+    results["meta"]["clients"] = args.clients
+    results["load"] = {}
+    paths = load_paths(venues_count, artists_count, rng)
+    for mode in args.modes.split(','):
+      results["load"][mode] = load_test(args, mode, paths)
+      print('%-24s %s' % ('load_' + mode, json.dumps(results["load"][mode])), file=sys.stderr)
+    write_results(results, args.output)
+    return
+
+  for route in routes(venues_count, artists_count, rng):
+    if args.routes in route[0]:
+      results["routes"][route[0]] = run_route(fyyur, client, route, args.requests)
+      print('%-24s %s' % (route[0], json.dumps(results["routes"][route[0]])), file=sys.stderr)
+
+  if args.routes in 'venues_memory':
+    results["memory"] = venues_memory(fyyur)
+    print('%-24s %s' % ('venues_memory', json.dumps(results["memory"])), file=sys.stderr)
+
+  write_results(results, args.output)
+
+  if args.compare:
+    with open(args.compare) as f:
+      regressions = compare(results, json.load(f), args.threshold)
+    if regressions:
+      sys.exit(1)
+
+if __name__ == '__main__':
+  main()
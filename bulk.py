@@ -0,0 +1,179 @@
+import csv
+import io
+import itertools
+import json
+import zlib
+from datetime import date, datetime
+
+"""
+******************* Notes about the bulk files *******************
+1- The rows of a file are read one by one ('read_rows'), so a large file is never in memory:
+    CSV (with a header line) or NDJSON (one JSON object per line).
+2- Every row is numbered from 1 (the header line of a CSV file is not counted), so an import
+    can report the rows it rejected and be resumed after the last row it committed.
+3- 'batches' groups the rows, so they are validated and inserted a batch at a time.
+4- The rows of an export are written one batch at a time, as CSV, NDJSON or Parquet (with the
+    optional pyarrow package), and can be compressed with gzip while they are written.
+5- 'copy_text' writes rows in the text format of PostgreSQL's 'COPY ... FROM STDIN'
+    (Reference: https://www.postgresql.org/docs/current/sql-copy.html)
+"""
+
+FORMATS = ('csv', 'ndjson')
+EXPORT_FORMATS = ('csv', 'ndjson', 'parquet')
+
+# This function reads a CSV file (a text stream) and yields (row number, {column: value})
+def read_csv(stream):
+  for number, row in enumerate(csv.DictReader(stream), 1):
+    yield number, row
+
+# This function reads an NDJSON file (a text stream) and yields (row number, {key: value}).
+# A line that isn't a JSON object is yielded as (row number, None), and the empty lines are skipped
+def read_ndjson(stream):
+  number = 0
+  for line in stream:
+    if not line.strip():
+      continue
+    number = number + 1
+    try:
+      row = json.loads(line)
+    except ValueError:
+      row = None
+    yield number, row if isinstance(row, dict) else None
+
+# This function reads the rows of a file in the given format ('csv' or 'ndjson'),
+# starting after the first 'skip' rows
+def read_rows(stream, format, skip=0):
+  if format == 'csv':
+    rows = read_csv(stream)
+  elif format == 'ndjson':
+    rows = read_ndjson(stream)
+  else:
+    raise ValueError('Unknown format: ' + str(format))
+  return itertools.islice(rows, skip, None)
+
+# This function guesses the format of a file from its name (e.g. 'venues.csv')
+def format_from_name(name):
+  for format in FORMATS:
+    if name.lower().endswith('.' + format):
+      return format
+  return None
+
+# This function groups the items in lists of 'size' items (the last one can be smaller)
+def batches(items, size):
+  items = iter(items)
+  while True:
+    batch = list(itertools.islice(items, size))
+    if not batch:
+      return
+    yield batch
+
+def copy_value(value):
+  if value is None:
+    return '\\N'
+  if isinstance(value, bool):
+    return 't' if value else 'f'
+  if isinstance(value, (datetime, date)):
+    return value.isoformat(' ') if isinstance(value, datetime) else value.isoformat()
+  return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+          .replace('\n', '\\n').replace('\r', '\\r'))
+
+# This function writes the rows ([{column: value}]) in the text format of 'COPY' and returns
+# the text stream to send
+def copy_text(rows, columns):
+  text = io.StringIO()
+  for row in rows:
+    text.write('\t'.join(copy_value(row[c]) for c in columns))
+    text.write('\n')
+  text.seek(0)
+  return text
+
+# This function converts a value to JSON and CSV (the dates as ISO 8601 strings)
+def text_value(value):
+  if isinstance(value, (datetime, date)):
+    return value.isoformat()
+  return value
+
+# This function writes batches of rows ([row]) as CSV with a header line, and yields the text of every batch
+def write_csv(batches, columns):
+  text = io.StringIO()
+  writer = csv.writer(text)
+  writer.writerow(columns)
+  for batch in batches:
+    writer.writerows([text_value(v) for v in row] for row in batch)
+    yield text.getvalue()
+    text.seek(0)
+    text.truncate()
+  if text.tell():
+    yield text.getvalue()
+
+# This function writes batches of rows ([row]) as NDJSON, and yields the text of every batch
+def write_ndjson(batches, columns):
+  for batch in batches:
+    yield ''.join(json.dumps({c: text_value(v) for c, v in zip(columns, row)}) + '\n' for row in batch)
+
+class ChunksSink:
+    # A write-only file that keeps what is written until it is taken, for pyarrow's writer
+    def __init__(self):
+      self.chunks = []
+      self.position = 0
+      self.closed = False
+
+    def write(self, data):
+      self.chunks.append(bytes(data))
+      self.position = self.position + len(data)
+      return len(data)
+
+    def tell(self):
+      return self.position
+
+    def flush(self):
+      pass
+
+    def close(self):
+      self.closed = True
+
+    def writable(self):
+      return True
+
+    def take(self):
+      data = b''.join(self.chunks)
+      self.chunks = []
+      return data
+
+# This function writes batches of rows ([row]) as Parquet (a row group per batch), and yields the
+# bytes of every batch. 'types' are the pyarrow types of the columns (see 'parquet_type')
+def write_parquet(batches, columns, types):
+  # pyarrow is only needed for the Parquet exports
+  import pyarrow
+  import pyarrow.parquet
+  schema = pyarrow.schema(list(zip(columns, types)))
+  sink = ChunksSink()
+  writer = pyarrow.parquet.ParquetWriter(sink, schema)
+  for batch in batches:
+    arrays = [pyarrow.array([row[i] for row in batch], type=t) for i, t in enumerate(types)]
+    writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+    yield sink.take()
+  writer.close()
+  yield sink.take()
+
+# This function returns the pyarrow type of a column's SQL type
+def parquet_type(sql_type):
+  import pyarrow
+  python_type = sql_type.python_type
+  if python_type is bool:
+    return pyarrow.bool_()
+  if python_type is int:
+    return pyarrow.int64()
+  if python_type is datetime:
+    return pyarrow.timestamp('us')
+  return pyarrow.string()
+
+# This function compresses the parts (text or bytes) of a file with gzip while they are written
+def gzip_parts(parts):
+  # wbits=31 writes the gzip header and trailer (Reference: https://docs.python.org/3/library/zlib.html)
+  compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+  for part in parts:
+    data = compressor.compress(part.encode('utf-8') if isinstance(part, str) else part)
+    if data:
+      yield data
+  yield compressor.flush()
@@ -0,0 +1,185 @@
+import fnmatch
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+"""
+******************* Notes about the cache *******************
+1- 'MemoryCache' is an in-process LRU cache: every entry has a time to live (TTL) and the
+    least recently used entry is evicted when the cache is full.
+2- 'SharedCache' keeps the entries in a shared store (e.g. Redis), so all the workers see the
+    same entries and the same invalidations. Any client with the 'get', 'setex', 'delete' and
+    'scan_iter' methods of redis-py can be used.
+3- 'LocalStore' is an in-process stand-in of that client (the 'local' backend), for the tests and
+    a single worker process: the entries go through 'SharedCache' the same way (pickled, expired
+    by the store) without a Redis server.
+4- 'NullCache' doesn't keep anything, to disable the cache.
+5- All of them count their hits, misses and evictions ('stats').
+"""
+
+class MemoryCache:
+    def __init__(self, max_entries=1024, default_ttl=300):
+      self.max_entries = max_entries
+      self.default_ttl = default_ttl
+      # key -> (expiry time, value), ordered from the least to the most recently used
+      self._entries = OrderedDict()
+      self._lock = threading.Lock()
+      self.hits = 0
+      self.misses = 0
+      self.evictions = 0
+
+    def get(self, key):
+      with self._lock:
+        entry = self._entries.get(key)
+        if entry is None:
+          self.misses = self.misses + 1
+          return None
+        expires_at, value = entry
+        # Drop the entry if its TTL is over
+        if expires_at <= time.monotonic():
+          del self._entries[key]
+          self.misses = self.misses + 1
+          return None
+        self._entries.move_to_end(key)
+        self.hits = self.hits + 1
+        return value
+
+    def set(self, key, value, ttl=None):
+      ttl = self.default_ttl if ttl is None else ttl
+      with self._lock:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        # Evict the least recently used entries
+        while len(self._entries) > self.max_entries:
+          self._entries.popitem(last=False)
+          self.evictions = self.evictions + 1
+
+    def delete(self, *keys):
+      with self._lock:
+        for key in keys:
+          self._entries.pop(key, None)
+
+    def clear(self):
+      with self._lock:
+        self._entries.clear()
+
+    def stats(self):
+      return {
+        "backend": "memory",
+        "entries": len(self._entries),
+        "max_entries": self.max_entries,
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": self.evictions
+      }
+
+class SharedCache:
+    def __init__(self, client, default_ttl=300, prefix='fyyur:'):
+      self.client = client
+      self.default_ttl = default_ttl
+      self.prefix = prefix
+      self.hits = 0
+      self.misses = 0
+
+    def get(self, key):
+      value = self.client.get(self.prefix + key)
+      if value is None:
+        self.misses = self.misses + 1
+        return None
+      self.hits = self.hits + 1
+      return pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+      ttl = self.default_ttl if ttl is None else ttl
+      # The store expires the entry by itself
+      self.client.setex(self.prefix + key, max(int(ttl), 1), pickle.dumps(value))
+
+    def delete(self, *keys):
+      if keys:
+        self.client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+      # The entries of the other applications in the store are kept
+      for key in self.client.scan_iter(self.prefix + '*'):
+        self.client.delete(key)
+
+    def stats(self):
+      # The store evicts the entries by itself, so it is the one that counts the evictions
+      try:
+        evictions = self.client.info('stats').get('evicted_keys')
+      except AttributeError:
+        evictions = None
+      return {
+        "backend": "shared",
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": evictions
+      }
+
+class LocalStore:
+    def __init__(self):
+      # key -> (expiry time, value)
+      self._entries = {}
+      self._lock = threading.Lock()
+
+    def get(self, key):
+      with self._lock:
+        entry = self._entries.get(key)
+        if entry is None:
+          return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+          del self._entries[key]
+          return None
+        return value
+
+    def setex(self, key, ttl, value):
+      with self._lock:
+        self._entries[key] = (time.monotonic() + ttl, value)
+
+    def delete(self, *keys):
+      with self._lock:
+        for key in keys:
+          self._entries.pop(key, None)
+
+    def scan_iter(self, match='*'):
+      with self._lock:
+        keys = [key for key in self._entries if fnmatch.fnmatchcase(key, match)]
+      return iter(keys)
+
+class NullCache:
+    def __init__(self):
+      self.misses = 0
+
+    def get(self, key):
+      self.misses = self.misses + 1
+      return None
+
+    def set(self, key, value, ttl=None):
+      pass
+
+    def delete(self, *keys):
+      pass
+
+    def clear(self):
+      pass
+
+    def stats(self):
+      return {"backend": "null", "hits": 0, "misses": self.misses, "evictions": 0}
+
+# This function creates the cache from the app's config ('DETAIL_CACHE_*' in config.py)
+def create_cache(config):
+  backend = config.get('DETAIL_CACHE_BACKEND', 'memory')
+  ttl = config.get('DETAIL_CACHE_TTL', 300)
+  if backend == 'memory':
+    return MemoryCache(config.get('DETAIL_CACHE_MAX_ENTRIES', 1024), ttl)
+  if backend == 'redis':
+    # The redis package is only needed for the shared cache
+    import redis
+    return SharedCache(redis.Redis.from_url(config['DETAIL_CACHE_URL']), ttl)
+  if backend == 'local':
+    return SharedCache(LocalStore(), ttl)
+  if backend == 'null':
+    return NullCache()
+  raise ValueError('Unknown DETAIL_CACHE_BACKEND: ' + backend)
@@ -0,0 +1,146 @@
+import functools
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from flask import current_app, g, has_app_context
+
+"""
+******************* Notes about the concurrent queries *******************
+1- 'gather' runs independent functions (e.g. the queries of a detail page) at the same time and
+    returns their results in order, when 'PARALLEL_QUERIES' (config.py) is 2 or more:
+    o in greenlets, when the app is served by the gevent workers (see serve.py), where psycopg2
+       waits for the database without blocking the other greenlets (psycogreen).
+    o otherwise in threads (psycopg2 releases the GIL while it waits for the database).
+    With 'PARALLEL_QUERIES' 0 or 1 (the default) they run one after the other.
+    Every function runs in a new app context with a copy of the request's 'g' (e.g. the chosen
+    read replica and the query instrumentation), so it has its own database session and takes
+    its own connection from the pool (the session is removed at the end).
+2- 'Batch' collects the data a view needs as (loader, key) pairs. A loader is a function that
+    takes a list of keys and returns {key: value} with one query ('IN (...)'), so all the keys of
+    a loader are loaded together (in chunks of 'BATCH_SIZE' keys), and the loaders run at the
+    same time with 'gather': one round trip for all the independent data of a page.
+3- The connections:
+    o Before the functions run, the request's session gives its connection back to the pool
+       (it ends its transaction), so a request never holds a connection while it waits for the
+       connections of its functions (N requests with a pool of N connections would wait for
+       each other until the pool's timeout).
+    o The threads (or greenlets) of 'gather' are shared by all the requests of a worker process,
+       so the functions use at most 'PARALLEL_QUERIES' connections at the same time, on top of
+       one connection per request being served (see serve.py for the limits of the pool).
+4- The sessions of the functions are closed when they return, so they must return plain values
+    (rows, lists, dictionaries) or ORM objects whose columns are read, not their relationships.
+5- The sessions of the functions don't see the changes the view hasn't committed, so when the
+    request's session has pending changes the functions run one after the other in it.
+6- A function run by 'gather' that calls 'gather' runs the functions one after the other, so the
+    threads (or greenlets) never wait for each other.
+"""
+
+# The number of keys of a loader per query
+BATCH_SIZE = 1000
+
+# The state of the current thread (or greenlet): 'nested' is set while it runs a function of 'gather'
+_state = threading.local()
+# The pool of threads (or greenlets) of 'gather', created on first use
+_executor = None
+_greenlets = None
+_executor_lock = threading.Lock()
+
+# This function checks if the process was patched by gevent (the gevent workers of serve.py)
+def gevent_enabled():
+  # gevent is optional, so don't import it if nothing else did
+  if 'gevent' not in sys.modules:
+    return False
+  from gevent import monkey
+  return monkey.is_module_patched('socket')
+
+# This function returns the pool of threads of 'gather'
+def executor(size):
+  global _executor
+  with _executor_lock:
+    if _executor is None:
+      _executor = ThreadPoolExecutor(size, thread_name_prefix='queries')
+    return _executor
+
+# This function returns the pool of greenlets of 'gather' (spawning waits while it is full)
+def greenlets(size):
+  global _greenlets
+  from gevent.pool import Pool
+  with _executor_lock:
+    if _greenlets is None:
+      _greenlets = Pool(size)
+    return _greenlets
+
+# This function ends the transaction of the request's session, so its connection goes back to the
+# pool before the functions of 'gather' take theirs. It returns False if the session has changes
+# that aren't committed (the functions can't see them)
+def release_connection(app):
+  state = app.extensions.get('sqlalchemy')
+  if state is None:
+    return True
+  session = state.db.session
+  if session.new or session.dirty or session.deleted:
+    return False
+  # There is nothing to write: it only ends the transaction (the loaded objects are reloaded when used)
+  session.commit()
+  return True
+
+# This function runs a function in a new app context with the values of the request's 'g'
+def _run(app, values, function):
+  _state.nested = True
+  try:
+    with app.app_context():
+      g.__dict__.update(values)
+      return function()
+  finally:
+    _state.nested = False
+
+# This function calls the functions (without arguments) at the same time and returns their results
+# in the same order. The first exception of a function is raised after all of them are done
+def gather(*functions):
+  if len(functions) < 2 or not has_app_context() or getattr(_state, 'nested', False):
+    return [function() for function in functions]
+  app = current_app._get_current_object()
+  size = app.config.get('PARALLEL_QUERIES', 0)
+  if size < 2 or not release_connection(app):
+    return [function() for function in functions]
+  values = dict(g.__dict__)
+
+  if gevent_enabled():
+    import gevent
+    spawned = [greenlets(size).spawn(_run, app, values, function) for function in functions]
+    gevent.joinall(spawned)
+    for greenlet in spawned:
+      if greenlet.exception is not None:
+        raise greenlet.exception
+    return [greenlet.value for greenlet in spawned]
+
+  futures = [executor(size).submit(_run, app, values, function) for function in functions]
+  wait(futures)
+  return [future.result() for future in futures]
+
+class Batch:
+    def __init__(self):
+      # loader -> the keys it needs (a dictionary keeps them in order, without duplicates)
+      self._needs = {}
+
+    # This function declares that the view needs the values of the keys from the loader
+    def need(self, loader, *keys):
+      needs = self._needs.setdefault(loader, {})
+      for key in keys:
+        needs[key] = None
+
+    # This function loads everything that was declared (one query per loader and chunk of keys,
+    # all at the same time) and returns {loader: {key: value}}
+    def resolve(self):
+      calls = []
+      for loader, needs in self._needs.items():
+        keys = list(needs)
+        for i in range(0, len(keys), BATCH_SIZE):
+          calls.append((loader, keys[i:i + BATCH_SIZE]))
+      results = gather(*[functools.partial(loader, keys) for loader, keys in calls])
+      values = {loader: {} for loader in self._needs}
+      for (loader, keys), result in zip(calls, results):
+        values[loader].update(result)
+      self._needs = {}
+      return values
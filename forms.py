@@ -2,7 +2,7 @@ from datetime import datetime
 # Added 'CsrfProtect' because of this error '{'csrf_token': ['The CSRF token is missing.']}'
 from flask_wtf import Form, CsrfProtect
 from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms.validators import DataRequired, AnyOf, URL, Optional, ValidationError
 
 csrf = CsrfProtect()
 
@@ -19,6 +19,14 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    # The end time is optional (the show lasts SHOW_DEFAULT_DURATION minutes by default)
+    end_time = DateTimeField(
+        'end_time', validators=[Optional()]
+    )
+
+    def validate_end_time(form, field):
+        if field.data and form.start_time.data and field.data <= form.start_time.data:
+            raise ValidationError('The end time must be after the start time.')
 
 class VenueForm(Form):
     name = StringField(
@@ -0,0 +1,167 @@
+import json
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+"""
+******************* Notes about the query instrumentation *******************
+1- Every SQL statement executed while a request is handled is timed (SQLAlchemy's
+    'before_cursor_execute' and 'after_cursor_execute' events) and recorded for the request:
+    the number of statements, the total database time, the slowest statements, and how many
+    times each statement "fingerprint" (the statement without its values) was repeated.
+2- A fingerprint repeated 'QUERY_N_PLUS_ONE_THRESHOLD' times or more in one request is
+    flagged as a likely N+1 pattern (e.g. a query per row of a listing).
+3- The results are sent in the 'Server-Timing' header, logged as one JSON line per request
+    (when 'QUERY_LOG' is set), and aggregated per view for the '/_debug/queries' report.
+4- When the app is testing and a view goes over its query budget ('QUERY_BUDGET'), the
+    request fails with 'QueryBudgetExceeded'.
+5- A streamed response runs some of its queries after its headers are sent, so its
+    'Server-Timing' header and budget only count the queries run before; the log line and
+    the report count all of them.
+"""
+
+# The values left in a statement and the lists of parameters of 'IN (...)'
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN \((?:[^()]|\([^()]*\))*\)", re.IGNORECASE)
+_SPACES = re.compile(r"\s+")
+
+# This function returns the fingerprint of a statement (the statement without its values)
+def fingerprint(statement):
+  statement = _STRING.sub('?', statement)
+  statement = _NUMBER.sub('?', statement)
+  statement = _IN_LIST.sub('IN (...)', statement)
+  return _SPACES.sub(' ', statement).strip()
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+class RequestQueries:
+    def __init__(self):
+      self.count = 0
+      self.duration = 0.0
+      # [(duration, statement)] of the slowest statements
+      self.slowest = []
+      self.fingerprints = Counter()
+      # The queries of a request can run in the threads of 'gather' (concurrency.py)
+      self._lock = threading.Lock()
+
+    def record(self, statement, duration, keep_slowest):
+      with self._lock:
+        self.count = self.count + 1
+        self.duration = self.duration + duration
+        self.fingerprints[fingerprint(statement)] += 1
+        self.slowest.append((duration, statement))
+        self.slowest.sort(key=lambda s: s[0], reverse=True)
+        del self.slowest[keep_slowest:]
+
+    def repeated(self, threshold):
+      return {f: n for f, n in self.fingerprints.items() if n >= threshold}
+
+class QueryInstrumentation:
+    def __init__(self, app=None):
+      self.app = None
+      # view -> aggregated statistics of its requests
+      self._report = {}
+      self._lock = threading.Lock()
+      if app is not None:
+        self.init_app(app)
+
+    def init_app(self, app):
+      self.app = app
+      app.config.setdefault('QUERY_SLOWEST', 5)
+      app.config.setdefault('QUERY_N_PLUS_ONE_THRESHOLD', 5)
+      app.config.setdefault('QUERY_LOG', False)
+      app.config.setdefault('QUERY_BUDGET', None)
+      # Listen to all the engines (the primary database and any other)
+      if not event.contains(Engine, 'before_cursor_execute', self._before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+      app.before_request(self._start_request)
+      app.after_request(self._finish_response)
+      app.teardown_request(self._finish_request)
+
+    # The statistics of the current request, or None outside a request
+    def current(self):
+      if not has_app_context():
+        return None
+      return g.get('_request_queries')
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+      conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+      duration = time.perf_counter() - conn.info['query_start_time'].pop()
+      stats = self.current()
+      if stats is not None:
+        stats.record(statement, duration, self.app.config['QUERY_SLOWEST'])
+
+    def _start_request(self):
+      g._request_queries = RequestQueries()
+
+    # This function returns the query budget of the current view
+    def budget(self):
+      budget = self.app.config['QUERY_BUDGET']
+      if isinstance(budget, dict):
+        return budget.get(request.endpoint)
+      return budget
+
+    def _finish_response(self, response):
+      stats = self.current()
+      if stats is None:
+        return response
+      # (Reference: https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Server-Timing)
+      response.headers.add('Server-Timing', 'db;dur=%.2f;desc="%d queries"' % (stats.duration * 1000, stats.count))
+      budget = self.budget()
+      if self.app.testing and budget is not None and stats.count > budget:
+        raise QueryBudgetExceeded(
+          '%s ran %d queries (budget: %d): %s' % (request.endpoint, stats.count, budget,
+                                                 json.dumps(stats.fingerprints.most_common(5))))
+      return response
+
+    def _finish_request(self, exception=None):
+      stats = g.pop('_request_queries', None)
+      if stats is None:
+        return
+      repeated = stats.repeated(self.app.config['QUERY_N_PLUS_ONE_THRESHOLD'])
+      # The requests that didn't match a view (e.g. 404) are reported together
+      endpoint = request.endpoint or 'unmatched'
+      if self.app.config['QUERY_LOG']:
+        self.app.logger.info(json.dumps({
+          "endpoint": endpoint,
+          "path": request.path,
+          "queries": stats.count,
+          "db_ms": round(stats.duration * 1000, 2),
+          "slowest": [{"ms": round(d * 1000, 2), "statement": s} for d, s in stats.slowest],
+          "n_plus_one": repeated
+        }))
+      with self._lock:
+        view = self._report.setdefault(endpoint, {
+          "requests": 0, "queries": 0, "max_queries": 0, "db_ms": 0.0, "n_plus_one": {}
+        })
+        view["requests"] += 1
+        view["queries"] += stats.count
+        view["max_queries"] = max(view["max_queries"], stats.count)
+        view["db_ms"] += stats.duration * 1000
+        for f, n in repeated.items():
+          view["n_plus_one"][f] = max(view["n_plus_one"].get(f, 0), n)
+
+    # The aggregated statistics of every view, for the '/_debug/queries' report
+    def report(self):
+      with self._lock:
+        return {endpoint: dict(view,
+                               avg_queries=round(view["queries"] / view["requests"], 2),
+                               avg_db_ms=round(view["db_ms"] / view["requests"], 2),
+                               db_ms=round(view["db_ms"], 2))
+                for endpoint, view in self._report.items()}
+
+    def reset(self):
+      with self._lock:
+        self._report.clear()
+
+queries = QueryInstrumentation()
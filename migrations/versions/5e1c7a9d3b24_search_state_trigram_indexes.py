@@ -0,0 +1,38 @@
+"""search state trigram indexes
+
+Revision ID: 5e1c7a9d3b24
+Revises: 3d6f8a2b4c95
+Create Date: 2026-10-18 18:40:12.305716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e1c7a9d3b24'
+down_revision = '3d6f8a2b4c95'
+branch_labels = None
+depends_on = None
+
+# (index name, table, column) of the trigram indexes of the states, so every condition of the search uses an index
+INDEXES = [
+    ('ix_venues_state_trgm', 'venues', 'state'),
+    ('ix_artists_state_trgm', 'artists', 'state'),
+]
+
+
+def upgrade():
+    is_postgresql = op.get_bind().dialect.name == 'postgresql'
+    for name, table, column in INDEXES:
+        if is_postgresql:
+            op.create_index(name, table, [column], unique=False,
+                            postgresql_using='gin',
+                            postgresql_ops={column: 'gin_trgm_ops'})
+        else:
+            op.create_index(name, table, [column], unique=False)
+
+
+def downgrade():
+    for name, table, column in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,72 @@
+"""shows end time
+
+Revision ID: a4c81e9d5f20
+Revises: f5a9c3e87d12
+Create Date: 2026-10-18 14:21:36.107482
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c81e9d5f20'
+down_revision = 'f5a9c3e87d12'
+branch_labels = None
+depends_on = None
+
+# The exclusion constraints that keep the shows of a venue (or an artist) from overlapping
+CONSTRAINTS = [
+    ('shows_venue_id_no_overlap', 'venue_id'),
+    ('shows_artist_id_no_overlap', 'artist_id'),
+]
+
+
+def upgrade():
+    is_postgresql = op.get_bind().dialect.name == 'postgresql'
+    op.add_column('shows', sa.Column('end_time', sa.DateTime(), nullable=True))
+    # The existing shows last the default duration (2 hours)
+    if is_postgresql:
+        op.execute("UPDATE shows SET end_time = start_time + interval '2 hours'")
+    else:
+        # (in the format SQLAlchemy stores the datetimes in SQLite)
+        op.execute("UPDATE shows SET end_time = strftime('%Y-%m-%d %H:%M:%S.000000', start_time, '+2 hours')")
+    with op.batch_alter_table('shows') as batch_op:
+        batch_op.alter_column('end_time', existing_type=sa.DateTime(), nullable=False)
+
+    # The default duration can make a show overlap the next show of its venue (or artist):
+    # it ends when the next one starts
+    for name, column in CONSTRAINTS:
+        op.execute(
+            f'UPDATE shows SET end_time = (SELECT MIN(later.start_time) FROM shows later '
+            f'WHERE later.{column} = shows.{column} AND later.start_time > shows.start_time) '
+            f'WHERE EXISTS (SELECT 1 FROM shows later WHERE later.{column} = shows.{column} '
+            f'AND later.start_time > shows.start_time AND later.start_time < shows.end_time)'
+        )
+
+    if is_postgresql:
+        # The shows of a venue (or an artist) that start at the same time still overlap,
+        # and they must be fixed (moved or deleted) before the constraints are added
+        for name, column in CONSTRAINTS:
+            duplicates = op.get_bind().execute(sa.text(
+                f'SELECT {column}, start_time FROM shows GROUP BY {column}, start_time '
+                f'HAVING COUNT(*) > 1 ORDER BY {column}, start_time LIMIT 10'
+            )).fetchall()
+            if duplicates:
+                raise RuntimeError(
+                    'Shows of the same %s start at the same time, fix them before this migration: %s'
+                    % (column, ', '.join('%s at %s' % (owner_id, start) for owner_id, start in duplicates)))
+
+        # btree_gist lets the '=' of the IDs be part of a GiST index with the time ranges
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        for name, column in CONSTRAINTS:
+            op.execute('ALTER TABLE shows ADD CONSTRAINT %s EXCLUDE USING gist '
+                       '(%s WITH =, tsrange(start_time, end_time) WITH &&)' % (name, column))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for name, column in CONSTRAINTS:
+            op.execute('ALTER TABLE shows DROP CONSTRAINT %s' % name)
+    with op.batch_alter_table('shows') as batch_op:
+        batch_op.drop_column('end_time')
@@ -0,0 +1,45 @@
+"""search trigram indexes
+
+Revision ID: b1d4f2a7c903
+Revises: d052fa8d3882
+Create Date: 2026-10-18 09:12:40.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b1d4f2a7c903'
+down_revision = 'd052fa8d3882'
+branch_labels = None
+depends_on = None
+
+# (index name, table, column) of the trigram indexes used by the search
+INDEXES = [
+    ('ix_venues_name_trgm', 'venues', 'name'),
+    ('ix_venues_city_trgm', 'venues', 'city'),
+    ('ix_artists_name_trgm', 'artists', 'name'),
+    ('ix_artists_city_trgm', 'artists', 'city'),
+    ('ix_venues_genres_genre_trgm', 'venues_genres', 'genre'),
+    ('ix_artists_genres_genre_trgm', 'artists_genres', 'genre'),
+]
+
+
+def upgrade():
+    is_postgresql = op.get_bind().dialect.name == 'postgresql'
+    if is_postgresql:
+        # The trigram operator classes make 'ILIKE %term%' use a GIN index
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in INDEXES:
+        if is_postgresql:
+            op.create_index(name, table, [column], unique=False,
+                            postgresql_using='gin',
+                            postgresql_ops={column: 'gin_trgm_ops'})
+        else:
+            op.create_index(name, table, [column], unique=False)
+
+
+def downgrade():
+    for name, table, column in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,96 @@
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+"""
+******************* Notes about the connection pool *******************
+1- The engine's pool is configured by 'DB_POOL_*' in config.py ('engine_options'). Every worker
+    process has its own pool, so the database sees up to (workers x (DB_POOL_SIZE +
+    DB_POOL_MAX_OVERFLOW)) connections: keep it under PostgreSQL's 'max_connections'.
+2- 'DB_POOL_PRE_PING' tests a connection before using it, so the connections broken by a restart
+    of the database are replaced instead of failing the request, and 'DB_POOL_RECYCLE' replaces
+    the connections older than that (e.g. before a firewall or the server closes them).
+3- 'TimedQueuePool' is SQLAlchemy's default pool that also measures the time the requests wait
+    to get a connection (a free one, or a new one) and counts the timeouts ('pool_stats').
+4- With an external pooler in transaction mode (e.g. PgBouncer, 'DB_POOLER = "transaction"'),
+    the pooler keeps the connections, so the app opens one per use ('NullPool') and doesn't
+    rely on anything that lasts longer than a transaction.
+5- SQLite doesn't use these options (SQLAlchemy picks its own pool for SQLite).
+6- 'pool_capacity' is the number of connections a worker process can have at the same time: a
+    request uses one at a time, and the queries of 'gather' (concurrency.py) 'PARALLEL_QUERIES'
+    more for all the requests of the worker, so serve.py keeps the requests a worker serves at
+    the same time within it (instead of letting them wait for a connection until the timeout).
+"""
+
+class TimedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+      super().__init__(*args, **kwargs)
+      self.checkouts = 0
+      self.timeouts = 0
+      self.wait_time = 0.0
+      self.max_wait_time = 0.0
+      self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+      start = time.perf_counter()
+      timed_out = False
+      try:
+        return super()._do_get()
+      except exc.TimeoutError:
+        timed_out = True
+        raise
+      finally:
+        wait_time = time.perf_counter() - start
+        with self._stats_lock:
+          self.checkouts = self.checkouts + 1
+          self.timeouts = self.timeouts + timed_out
+          self.wait_time = self.wait_time + wait_time
+          self.max_wait_time = max(self.max_wait_time, wait_time)
+
+# This function returns the engine options ('SQLALCHEMY_ENGINE_OPTIONS') from 'DB_POOL_*' in config.py
+def engine_options(config):
+  options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+  if config.get('SQLALCHEMY_DATABASE_URI', '').startswith('sqlite'):
+    return options
+  if config.get('DB_POOLER') == 'transaction':
+    options.setdefault('poolclass', NullPool)
+    return options
+  options.setdefault('poolclass', TimedQueuePool)
+  options.setdefault('pool_size', config.get('DB_POOL_SIZE', 5))
+  options.setdefault('max_overflow', config.get('DB_POOL_MAX_OVERFLOW', 10))
+  options.setdefault('pool_timeout', config.get('DB_POOL_TIMEOUT', 30))
+  options.setdefault('pool_recycle', config.get('DB_POOL_RECYCLE', -1))
+  options.setdefault('pool_pre_ping', config.get('DB_POOL_PRE_PING', True))
+  return options
+
+# This function returns the number of connections the pool of a worker process can open at the same time
+# ('DB_POOL_SIZE' + 'DB_POOL_MAX_OVERFLOW'), or None if it isn't limited (SQLite, or an external pooler)
+def pool_capacity(config):
+  options = engine_options(config)
+  if not issubclass(options.get('poolclass', NullPool), QueuePool) or options['max_overflow'] < 0:
+    return None
+  return options['pool_size'] + options['max_overflow']
+
+# This function returns the statistics of an engine's pool
+def pool_stats(pool):
+  stats = {"class": type(pool).__name__, "status": pool.status()}
+  if isinstance(pool, QueuePool):
+    stats.update({
+      "size": pool.size(),
+      "checked_in": pool.checkedin(),
+      "checked_out": pool.checkedout(),
+      "overflow": max(pool.overflow(), 0),
+      "max_overflow": pool._max_overflow,
+      "timeout": pool._timeout
+    })
+  if isinstance(pool, TimedQueuePool):
+    with pool._stats_lock:
+      stats.update({
+        "checkouts": pool.checkouts,
+        "timeouts": pool.timeouts,
+        "avg_wait_ms": round(pool.wait_time * 1000 / pool.checkouts, 3) if pool.checkouts else 0.0,
+        "max_wait_ms": round(pool.max_wait_time * 1000, 3)
+      })
+  return stats
@@ -0,0 +1,69 @@
+import random
+import time
+
+from flask import g, has_app_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.sql.expression import UpdateBase
+
+"""
+******************* Notes about the read replicas *******************
+1- The URLs of the read replicas ('SQLALCHEMY_REPLICA_URIS' in config.py) are added to the binds
+    of Flask-SQLAlchemy ('replica_0', 'replica_1', ...), so each one has its own engine and pool.
+2- The views in 'REPLICA_VIEWS' (the read-only pages and their API) read from one of the
+    replicas, chosen at random for the whole request ('RoutingSession.get_bind'). The other
+    views, the writes (flushes and INSERT/UPDATE/DELETE statements) and the commands use the
+    primary database.
+3- A replica can be a little behind the primary, so after a request that can write (any
+    method other than GET/HEAD, outside 'REPLICA_VIEWS'), the user's session keeps the time of
+    the write, and the user reads from the primary for 'REPLICA_READ_YOUR_WRITES' seconds.
+4- Without replicas, everything uses the primary database as before.
+"""
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+      # (the app context, so the functions run by 'gather' in other greenlets use it too)
+      replica = g.get('_read_replica') if has_app_context() else None
+      # The writes always go to the primary database
+      if replica is not None and not self._flushing and not isinstance(clause, UpdateBase):
+        return get_state(self.app).db.get_engine(self.app, bind=replica)
+      return super().get_bind(mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+      return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+# The bind keys of the replicas of the app
+def replica_binds(app):
+  return ['replica_%d' % i for i in range(len(app.config.get('SQLALCHEMY_REPLICA_URIS') or ()))]
+
+# This function checks if the request reads from a replica (and not from the primary database)
+def using_replica():
+  return has_app_context() and g.get('_read_replica') is not None
+
+def init_app(app):
+  app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+  app.config.setdefault('REPLICA_VIEWS', set())
+  app.config.setdefault('REPLICA_READ_YOUR_WRITES', 5)
+  binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+  binds.update(zip(replica_binds(app), app.config['SQLALCHEMY_REPLICA_URIS']))
+  app.config['SQLALCHEMY_BINDS'] = binds or None
+
+  @app.before_request
+  def choose_database():
+    g._read_replica = None
+    replicas = replica_binds(app)
+    if not replicas or request.endpoint not in app.config['REPLICA_VIEWS']:
+      return
+    # Read your own writes: the user wrote recently, so the replicas may not have the change yet
+    last_write = session.get('_last_write')
+    if last_write and time.time() - last_write < app.config['REPLICA_READ_YOUR_WRITES']:
+      return
+    g._read_replica = random.choice(replicas)
+
+  @app.after_request
+  def remember_write(response):
+    if (replica_binds(app) and request.method not in ('GET', 'HEAD', 'OPTIONS')
+        and request.endpoint not in app.config['REPLICA_VIEWS']):
+      session['_last_write'] = time.time()
+    return response
@@ -0,0 +1,36 @@
+from sortedcontainers import SortedList
+
+"""
+******************* Notes about the schedule index *******************
+1- 'ScheduleIndex' keeps the time slots [start, end) of the shows of many venues and artists in
+    memory, sorted by their start time, to check the shows of a bulk load against each other
+    and against the shows that already exist (loaded once per batch).
+2- The slots of a venue (or an artist) don't overlap, so the only slot that can overlap a new
+    one is the last slot that starts before the new one ends: it is found by a binary search
+    (O(log n)), like the database does with the index on (venue_id, start_time).
+3- The slots of a key are kept in a 'SortedList' (sortedcontainers), so adding a slot is also
+    O(log n) and loading n shows costs O(n log n) (a sorted Python list would move its items).
+4- Two shows that follow each other (the first ends when the second starts) don't overlap.
+"""
+
+class ScheduleIndex:
+    def __init__(self):
+      # key (e.g. ('venue', 1)) -> its slots (start, end), sorted by their start times
+      self._slots = {}
+
+    # This function returns the slot (start, end) of the key that overlaps [start, end), or None
+    def conflict(self, key, start, end):
+      slots = self._slots.get(key)
+      if not slots:
+        return None
+      # The last slot that starts before the end of the new one ('(end,)' sorts before '(end, ...)')
+      i = slots.bisect_left((end,)) - 1
+      if i >= 0 and slots[i][1] > start:
+        return slots[i]
+      return None
+
+    def add(self, key, start, end):
+      slots = self._slots.get(key)
+      if slots is None:
+        slots = self._slots[key] = SortedList()
+      slots.add((start, end))
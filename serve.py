@@ -0,0 +1,142 @@
+"""
+******************* Notes about the server *******************
+1- It serves the app with worker processes ('--workers') that share one listening socket,
+    in one of two modes:
+    o 'sync': a worker handles one request at a time (Werkzeug's WSGI server), so it waits
+       for every round trip to the database.
+    o 'gevent': a worker handles up to '--concurrency' requests at a time in greenlets. The
+       process is patched by gevent and psycopg2 by psycogreen, so while a request waits for
+       PostgreSQL the worker serves the other requests, and 'gather' (concurrency.py) can run
+       the independent queries of a page at the same time ('PARALLEL_QUERIES').
+2- Flask 1.1 has no async views and SQLAlchemy 1.3 no async driver, so the gevent mode is the
+    async mode of this app: the views don't change. It needs the optional gevent and psycogreen
+    packages (pip install gevent psycogreen).
+3- The workers open their own database connections (the parent process never uses the
+    database), and 'DB_POOL_SIZE' plus 'DB_POOL_MAX_OVERFLOW' (see pool.py) limit the connections
+    of every worker. A request uses one connection at a time and the queries run by 'gather' use
+    up to 'PARALLEL_QUERIES' more per worker, so '--concurrency' plus 'PARALLEL_QUERIES' must stay
+    within the pool: '--concurrency' is the rest of the pool by default, and the server doesn't
+    start with more (the requests would wait for a connection until 'DB_POOL_TIMEOUT').
+    On SQLite (or with an external pooler) the app doesn't limit its connections, and
+    '--concurrency' is 100 by default.
+4- Without fork (e.g. on Windows), use '--workers 1': the app is served by the process itself.
+5- 'python benchmark.py --load' compares the two modes with the same number of workers.
+
+Examples:
+  python serve.py --workers 4
+  python serve.py --mode gevent --workers 4 --concurrency 200 --port 8000
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+
+def parse_args(argv=None):
+  parser = argparse.ArgumentParser(description='Serve the Fyyur app with worker processes.')
+  parser.add_argument('--mode', choices=['sync', 'gevent'], default='sync')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=5000)
+  parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='The number of worker processes.')
+  parser.add_argument('--concurrency', type=int,
+                      help='The number of requests a gevent worker handles at the same time '
+                           '(by default, as many as its connection pool allows).')
+  parser.add_argument('--access-log', action='store_true', help='Log every request.')
+  return parser.parse_args(argv)
+
+# This function patches the process for the gevent mode, before the app (and the sockets, psycopg2, ...) is used
+def patch_gevent():
+  try:
+    from gevent import monkey
+  except ImportError:
+    sys.exit('The gevent mode needs the gevent and psycogreen packages (pip install gevent psycogreen).')
+  monkey.patch_all()
+  try:
+    import psycopg2
+  except ImportError:
+    # There is no PostgreSQL driver to patch (e.g. with SQLite)
+    return
+  try:
+    import psycogreen.gevent
+  except ImportError:
+    sys.exit('The gevent mode needs the psycogreen package with PostgreSQL (pip install psycogreen).')
+  psycogreen.gevent.patch_psycopg()
+
+# This function checks that the requests a worker serves at the same time (and the queries they run with
+# 'gather') fit in its connection pool, and sets the default '--concurrency' of the gevent mode
+def check_pool(config, args):
+  from pool import pool_capacity
+  capacity = pool_capacity(config)
+  parallel = config.get('PARALLEL_QUERIES', 0) if config.get('PARALLEL_QUERIES', 0) >= 2 else 0
+  if args.mode == 'gevent' and args.concurrency is None:
+    args.concurrency = 100 if capacity is None else capacity - parallel
+  concurrency = args.concurrency if args.mode == 'gevent' else 1
+  if concurrency < 1:
+    sys.exit('--concurrency must be at least 1.')
+  if capacity is not None and concurrency + parallel > capacity:
+    sys.exit('A worker can use %d connections at the same time (%d for the requests and PARALLEL_QUERIES=%d), '
+             'but its pool has %d (DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW): lower --concurrency or '
+             'PARALLEL_QUERIES, or raise the pool.' % (concurrency + parallel, concurrency, parallel, capacity))
+
+# This function opens the listening socket shared by the workers
+def listen(host, port):
+  sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  sock.bind((host, port))
+  sock.listen(1024)
+  return sock
+
+# This function serves the app on the socket until the worker is stopped
+def serve(app, sock, args):
+  if args.mode == 'gevent':
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+    WSGIServer(sock, app, spawn=Pool(args.concurrency), log='default' if args.access_log else None).serve_forever()
+  else:
+    from werkzeug.serving import BaseWSGIServer
+    if not args.access_log:
+      logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    BaseWSGIServer(args.host, args.port, app, fd=sock.fileno()).serve_forever()
+
+def main(argv=None):
+  args = parse_args(argv)
+  if args.mode == 'gevent':
+    patch_gevent()
+  from app import app
+  check_pool(app.config, args)
+
+  sock = listen(args.host, args.port)
+  print('Serving on http://%s:%d (%s mode, %d workers)' % (args.host, args.port, args.mode, args.workers),
+        file=sys.stderr)
+  if args.workers <= 1:
+    serve(app, sock, args)
+    return
+
+  workers = []
+  for _ in range(args.workers):
+    pid = os.fork()
+    if pid == 0:
+      # The worker process
+      try:
+        serve(app, sock, args)
+      except KeyboardInterrupt:
+        pass
+      finally:
+        os._exit(0)
+    workers.append(pid)
+
+  # Stop the workers with the server
+  def stop(signum, frame):
+    for pid in workers:
+      try:
+        os.kill(pid, signal.SIGTERM)
+      except ProcessLookupError:
+        pass
+  signal.signal(signal.SIGTERM, stop)
+  signal.signal(signal.SIGINT, stop)
+  for pid in workers:
+    os.waitpid(pid, 0)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# The tests import the app's modules (app.py, config.py, ...) from the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app on a new SQLite database (created with the models), whatever 'DATABASE_URL' is, for the
+# tests that run offline. The replica tests give the URLs of their replicas with 'replicas'
+@pytest.fixture
+def sqlite_app(tmp_path, monkeypatch):
+  import app as fyyur
+  from cache import NullCache
+
+  def configure(replicas=0):
+    uris = ['sqlite:///%s' % (tmp_path / ('replica_%d.db' % i)) for i in range(replicas)]
+    monkeypatch.setitem(fyyur.app.config, 'SQLALCHEMY_DATABASE_URI', 'sqlite:///%s' % (tmp_path / 'fyyur.db'))
+    monkeypatch.setitem(fyyur.app.config, 'SQLALCHEMY_ENGINE_OPTIONS', {})
+    monkeypatch.setitem(fyyur.app.config, 'SQLALCHEMY_REPLICA_URIS', uris)
+    monkeypatch.setitem(fyyur.app.config, 'SQLALCHEMY_BINDS',
+                        {'replica_%d' % i: uri for i, uri in enumerate(uris)} or None)
+    monkeypatch.setitem(fyyur.app.config, 'WTF_CSRF_ENABLED', False)
+    # The pages are built from the database of the test, not from the cache of another test
+    monkeypatch.setattr(fyyur, 'detail_cache', NullCache())
+    with fyyur.app.app_context():
+      for bind in [None] + ['replica_%d' % i for i in range(replicas)]:
+        fyyur.db.Model.metadata.create_all(fyyur.db.get_engine(fyyur.app, bind=bind))
+    return fyyur.app
+
+  yield configure
+  with fyyur.app.app_context():
+    fyyur.db.session.remove()
@@ -0,0 +1,52 @@
+"""
+******************* Notes about the availability tests *******************
+1- They run on a new SQLite database (the 'sqlite_app' fixture of conftest.py), so they don't need
+    PostgreSQL.
+2- The times of the arguments can have a UTC offset or not, and both kinds can be mixed (one
+    argument with an offset and the other without).
+"""
+from datetime import datetime
+
+import pytest
+
+from app import db, Venue, Artist, Show
+
+@pytest.fixture
+def client(sqlite_app):
+  app = sqlite_app()
+  with app.app_context():
+    db.session.add_all([
+      Venue(id=1, name='The Musical Hop', city='San Francisco', state='CA'),
+      Venue(id=2, name='Park Square', city='San Francisco', state='CA'),
+      Artist(id=1, name='Guns N Petals', city='San Francisco', state='CA'),
+      Show(venue_id=1, artist_id=1, start_time=datetime(2030, 1, 1, 20), end_time=datetime(2030, 1, 1, 22)),
+    ])
+    db.session.commit()
+  return app.test_client()
+
+@pytest.mark.parametrize('start, end', [
+  ('2030-01-01T19:00Z', '2030-01-01T21:00'),
+  ('2030-01-01T19:00', '2030-01-01T21:00Z'),
+  ('2030-01-01T21:00+02:00', '2030-01-01T21:00'),
+])
+def test_free_venues_mixed_offsets(client, start, end):
+  response = client.get('/api/v1/availability/venues',
+                        query_string={"city": 'San Francisco', "state": 'CA', "start": start, "end": end})
+  assert response.status_code == 200
+  # The Musical Hop has a show from 20:00 (UTC) to 22:00
+  assert [v["name"] for v in response.get_json()["venues"]] == ['Park Square']
+
+@pytest.mark.parametrize('start, end, names', [
+  ('2030-01-01T00:00', '2030-01-02T00:00Z', ['Guns N Petals']),
+  ('2030-01-01T00:00Z', '2030-01-01T20:00', []),
+  # 21:00 at +02:00 is 19:00 UTC, before the show
+  ('2030-01-01T00:00', '2030-01-01T21:00+02:00', []),
+])
+def test_touring_artists_mixed_offsets(client, start, end, names):
+  response = client.get('/api/v1/availability/artists', query_string={"state": 'CA', "start": start, "end": end})
+  assert response.status_code == 200
+  assert [a["name"] for a in response.get_json()["artists"]] == names
+
+def test_touring_artists_end_with_offset_only(client):
+  response = client.get('/api/v1/availability/artists', query_string={"state": 'CA', "end": '2031-01-01T00:00Z'})
+  assert response.status_code == 200
@@ -0,0 +1,26 @@
+"""
+******************* Notes about the import tests *******************
+1- They import rows with 'import_rows' on a new SQLite database (the 'sqlite_app' fixture of
+    conftest.py), so they don't need PostgreSQL.
+"""
+import pytest
+
+from app import db, import_rows, Venue, Artist, Show
+
+@pytest.fixture
+def app(sqlite_app):
+  app = sqlite_app()
+  with app.app_context():
+    db.session.add_all([Venue(id=1, name='The Musical Hop', city='San Francisco', state='CA'),
+                        Artist(id=1, name='Guns N Petals', city='San Francisco', state='CA')])
+    db.session.commit()
+    yield app
+
+def test_show_without_start_time_is_rejected(app):
+  rows = [(1, {"venue_id": 1, "artist_id": 1}),
+          (2, {"venue_id": 1, "artist_id": 1, "start_time": '2030-01-01 20:00:00'})]
+  [report] = import_rows('shows', iter(rows))
+  assert report["imported"] == 1
+  assert [r["row"] for r in report["rejected"]] == [1]
+  assert 'start_time' in report["rejected"][0]["errors"]
+  assert [str(s.start_time) for s in Show.query.all()] == ['2030-01-01 20:00:00']
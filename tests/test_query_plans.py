@@ -0,0 +1,101 @@
+"""
+******************* Notes about the query plan tests *******************
+1- They check with 'EXPLAIN' that the listing, detail and search queries can use the indexes of
+    the migrations (e.g. 'ix_shows_venue_id_start_time' and the trigram indexes of the search).
+2- They need the PostgreSQL database of 'DATABASE_URL' migrated to the last revision
+    ('flask db upgrade'), and are skipped on the other databases.
+3- The tables of a test database are small, so the sequential scans are disabled while the
+    statements are explained: the tests check that an index can be used, not that the planner
+    prefers it for a few rows.
+
+Example:
+  DATABASE_URL=postgresql://localhost/fyyur_test python -m pytest tests
+"""
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import OperationalError
+
+from app import app, db, search, shows_data, encode_cursor, Venue, Artist, Venues_Genres, Artists_Genres, \
+  load_venues_upcoming_shows, load_venues_past_shows, load_artists_upcoming_shows, load_artists_past_shows
+
+@pytest.fixture(autouse=True)
+def postgresql():
+  if make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name() != 'postgresql':
+    pytest.skip('The query plans are checked on PostgreSQL')
+  with app.app_context():
+    try:
+      db.engine.connect().close()
+    except (ImportError, OperationalError) as e:
+      pytest.skip('PostgreSQL is not available: %s' % e)
+    yield
+
+# This function records the statements (and their parameters) run in the block
+@contextmanager
+def recorded_statements():
+  statements = []
+  def record(conn, cursor, statement, parameters, context, executemany):
+    statements.append((statement, parameters))
+  event.listen(db.engine, 'before_cursor_execute', record)
+  try:
+    yield statements
+  finally:
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+# This function returns the plans of the statements, as text
+def plans(statements):
+  connection = db.engine.raw_connection()
+  try:
+    cursor = connection.cursor()
+    # Only for the transaction of the 'EXPLAIN's (rolled back when the connection returns to the pool)
+    cursor.execute('SET LOCAL enable_seqscan = off')
+    result = []
+    for statement, parameters in statements:
+      cursor.execute('EXPLAIN ' + statement, parameters)
+      result.append('\n'.join(row[0] for row in cursor.fetchall()))
+    return result
+  finally:
+    connection.close()
+
+# This function checks that the index is scanned by the plan of one of the statements
+def assert_index_scan(statements, index):
+  explained = plans(statements)
+  assert any('Index' in line and index in line for plan in explained for line in plan.splitlines()), \
+    '%s is not used:\n\n%s' % (index, '\n\n'.join(explained))
+
+@pytest.mark.parametrize('model, genres_model, owner_column, prefix', [
+  (Venue, Venues_Genres, Venues_Genres.venue_id, 'venues'),
+  (Artist, Artists_Genres, Artists_Genres.artist_id, 'artists'),
+])
+def test_search_uses_trigram_indexes(model, genres_model, owner_column, prefix):
+  with recorded_statements() as statements:
+    search(model, genres_model, owner_column, 'rock, CA')
+  for index in ('name_trgm', 'city_trgm', 'state_trgm'):
+    assert_index_scan(statements[:1], 'ix_%s_%s' % (prefix, index))
+  assert_index_scan(statements[:1], 'ix_%s_genres_genre_trgm' % prefix)
+
+@pytest.mark.parametrize('url, index', [
+  ('/shows', 'ix_upcoming_shows_start_time'),
+  ('/shows?period=past', 'ix_shows_start_time'),
+  ('/shows?period=all', 'ix_shows_start_time'),
+])
+def test_shows_pages_use_start_time_indexes(url, index):
+  cursor = encode_cursor([datetime(2020, 1, 1), 1])
+  for page_url in (url, url + ('&' if '?' in url else '?') + 'after=' + cursor):
+    with app.test_request_context(page_url), recorded_statements() as statements:
+      list(shows_data()[0])
+    assert_index_scan(statements, index)
+
+@pytest.mark.parametrize('loader, index', [
+  (load_venues_upcoming_shows, 'ix_upcoming_shows_venue_id_start_time'),
+  (load_venues_past_shows, 'ix_shows_venue_id_start_time'),
+  (load_artists_upcoming_shows, 'ix_upcoming_shows_artist_id_start_time'),
+  (load_artists_past_shows, 'ix_shows_artist_id_start_time'),
+])
+def test_detail_shows_use_owner_indexes(loader, index):
+  with recorded_statements() as statements:
+    loader([1, 2, 3])
+  assert_index_scan(statements, index)
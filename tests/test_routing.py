@@ -0,0 +1,63 @@
+"""
+******************* Notes about the read replica tests *******************
+1- The primary database and the replica are two SQLite files (the 'sqlite_app' fixture of
+    conftest.py) with different data, so a response tells which one the view read from.
+2- Nothing copies the primary to the replica: a venue created on the primary is only found by
+    the views that read from the primary.
+"""
+import pytest
+
+from app import app as flask_app, db, Venue
+
+# The form of a new venue, as sent by the create page
+VENUE_FORM = {
+  "name": 'Park Square', "city": 'San Francisco', "state": 'CA', "address": '34 Whiskey Moore Ave',
+  "phone": '415-000-1234', "image_link": 'https://example.com/park-square.jpg',
+  "facebook_link": 'https://www.facebook.com/ParkSquare', "website": 'https://www.parksquare.com',
+  "genres": ['Jazz'], "seeking_talent": 'No', "seeking_description": ''
+}
+
+@pytest.fixture
+def client(sqlite_app):
+  app = sqlite_app(replicas=1)
+  with app.app_context():
+    # The same venue with a different name in each database
+    for bind, name in ((None, 'The Musical Hop (primary)'), ('replica_0', 'The Musical Hop (replica)')):
+      db.get_engine(app, bind=bind).execute(Venue.__table__.insert(), {
+        "id": 1, "name": name, "city": 'San Francisco', "state": 'CA', "seeking_talent": False})
+  return app.test_client()
+
+# This function returns the status and the name of the venue of '/api/v1/venues/<venue_id>'
+def venue_name(client, venue_id):
+  response = client.get('/api/v1/venues/%d' % venue_id)
+  return response.status_code, (response.get_json() or {}).get("name")
+
+def test_replica_views_read_from_the_replica(client):
+  assert venue_name(client, 1) == (200, 'The Musical Hop (replica)')
+
+def test_other_views_read_from_the_primary(client, monkeypatch):
+  # (the form of the edit page renders its CSRF token)
+  monkeypatch.setitem(flask_app.config, 'WTF_CSRF_ENABLED', True)
+  response = client.get('/venues/1/edit')
+  assert response.status_code == 200
+  assert b'The Musical Hop (primary)' in response.data
+
+def test_writes_go_to_the_primary_and_are_read_back(client):
+  response = client.post('/venues/create', data=VENUE_FORM)
+  assert response.status_code in (200, 302)
+  with flask_app.app_context():
+    assert [v.name for v in Venue.query.order_by(Venue.id)] == ['The Musical Hop (primary)', 'Park Square']
+  # Read your writes: the user reads from the primary right after the write
+  assert venue_name(client, 2) == (200, 'Park Square')
+  assert venue_name(client, 1) == (200, 'The Musical Hop (primary)')
+
+def test_other_users_still_read_from_the_replica(client):
+  client.post('/venues/create', data=VENUE_FORM)
+  other = flask_app.test_client()
+  assert venue_name(other, 1) == (200, 'The Musical Hop (replica)')
+  assert venue_name(other, 2)[0] == 404
+
+def test_replica_after_the_read_your_writes_window(client, monkeypatch):
+  monkeypatch.setitem(flask_app.config, 'REPLICA_READ_YOUR_WRITES', 0)
+  client.post('/venues/create', data=VENUE_FORM)
+  assert venue_name(client, 1) == (200, 'The Musical Hop (replica)')
@@ -0,0 +1,94 @@
+"""
+******************* Notes about the upcoming shows tests *******************
+1- They check that the 'Upcoming_Shows' projection follows the shows, venues and artists through
+    the pages that change them, on a new SQLite database (the 'sqlite_app' fixture of conftest.py).
+2- The expiry runs 'flask rollover-shows' at a later time, by replacing the current time of app.py.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+from app import db, Venue, Artist, Show, Upcoming_Shows
+
+START_TIME = datetime(2030, 1, 1, 20)
+
+# The forms of the edit pages, as sent by the browser
+VENUE_FORM = {
+  "name": 'The Musical Hop', "city": 'San Francisco', "state": 'CA', "address": '1015 Folsom Street',
+  "phone": '123-123-1234', "image_link": 'https://example.com/hop.jpg',
+  "facebook_link": 'https://www.facebook.com/TheMusicalHop', "website": 'https://www.themusicalhop.com',
+  "genres": ['Jazz'], "seeking_talent": 'No', "seeking_description": ''
+}
+ARTIST_FORM = {
+  "name": 'Guns N Petals', "city": 'San Francisco', "state": 'CA', "phone": '326-123-5000',
+  "image_link": 'https://example.com/petals.jpg', "facebook_link": 'https://www.facebook.com/GunsNPetals',
+  "website": 'https://www.gunsnpetalsband.com', "genres": ['Rock n Roll'], "seeking_venue": 'No',
+  "seeking_description": ''
+}
+
+@pytest.fixture
+def app(sqlite_app):
+  app = sqlite_app()
+  with app.app_context():
+    db.session.add_all([Venue(id=1, name='The Musical Hop', city='San Francisco', state='CA'),
+                        Venue(id=2, name='Park Square', city='San Francisco', state='CA'),
+                        Artist(id=1, name='Guns N Petals', city='San Francisco', state='CA')])
+    db.session.commit()
+    yield app
+
+@pytest.fixture
+def client(app):
+  return app.test_client()
+
+# This function creates a show with the create page
+def create_show(client, venue_id, start_time=START_TIME):
+  response = client.post('/shows/create', data={
+    "venue_id": str(venue_id), "artist_id": '1', "start_time": start_time.strftime('%Y-%m-%d %H:%M:%S')})
+  assert response.status_code in (200, 302)
+
+# This function returns the rows of the projection: [(show ID, venue, artist, start time)]
+def upcoming_shows():
+  db.session.remove()
+  return [(u.show_id, u.venue_name, u.artist_name, u.start_time)
+          for u in Upcoming_Shows.query.order_by(Upcoming_Shows.show_id)]
+
+def test_created_show_is_added(client):
+  create_show(client, 1)
+  show = Show.query.one()
+  assert upcoming_shows() == [(show.id, 'The Musical Hop', 'Guns N Petals', START_TIME)]
+
+def test_past_show_is_not_added(client):
+  create_show(client, 1, datetime.now() - timedelta(days=1))
+  assert Show.query.count() == 1
+  assert upcoming_shows() == []
+
+def test_edited_venue_and_artist_are_renamed(client):
+  create_show(client, 1)
+  client.post('/venues/1/edit', data=dict(VENUE_FORM, name='The Musical Hop Club'))
+  client.post('/artists/1/edit', data=dict(ARTIST_FORM, name='Guns N Roses'))
+  assert [u[1:3] for u in upcoming_shows()] == [('The Musical Hop Club', 'Guns N Roses')]
+
+def test_deleted_venue_shows_are_removed(client):
+  create_show(client, 1)
+  create_show(client, 2, START_TIME + timedelta(days=1))
+  response = client.delete('/venues/1')
+  assert response.status_code == 200
+  assert [u[1] for u in upcoming_shows()] == ['Park Square']
+
+def test_started_shows_expire(client, app, monkeypatch):
+  create_show(client, 1)
+  create_show(client, 2, START_TIME + timedelta(days=1))
+
+  # The current time of app.py, an hour after the first show started
+  class Later(datetime):
+    @classmethod
+    def now(cls, tz=None):
+      return START_TIME + timedelta(hours=1)
+  monkeypatch.setattr(fyyur, 'datetime', Later)
+  result = app.test_cli_runner().invoke(args=['rollover-shows', '--hours', str(24 * 365 * 10)])
+  assert result.exit_code == 0, result.output
+  assert [u[1] for u in upcoming_shows()] == ['Park Square']
+  # The show itself is kept, and counted as past
+  assert Show.query.count() == 2
+  assert (Venue.query.get(1).upcoming_shows_count, Venue.query.get(1).past_shows_count) == (0, 1)